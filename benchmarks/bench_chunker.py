@@ -0,0 +1,122 @@
+"""
+Бенчмарк нарезки: RecursiveCharacterTextSplitter из langchain против
+services.chunker.TextChunker (целиком и в потоковом режиме по страницам).
+
+Перед замером проверяется эквивалентность: на корпусе и на случайных текстах
+с разными разделителями, размерами чанков и перекрытиями оба сплиттера должны
+давать одинаковые чанки, потоковая нарезка при любом разбиении текста на сегменты —
+те же чанки, что и нарезка целиком, а смещения — указывать ровно на текст чанка.
+langchain нужен только этому бенчмарку: pip install langchain-text-splitters.
+
+Запуск: python -m benchmarks.bench_chunker [--paragraphs 20000] [--fuzz 2000]
+"""
+import argparse
+import random
+import subprocess
+import sys
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.corpus import generate_pages, generate_text
+from services.chunker import TextChunker
+from services.text_pipeline import _separate_pages, iter_chunk_spans, iter_page_chunks, text_splitter
+
+FUZZ_PIECES = ["\n\n", "\n", ".", ". ", " ", "  ", "\t", "\n\n\n", "a", "слово", "x" * 40]
+FUZZ_SEPARATORS = [["\n\n", "\n", ".", " ", ""], ["\n\n", "\n", " "], [". ", "\n"]]
+
+
+def langchain_splitter(chunk_size=1000, chunk_overlap=100, separators=("\n\n", "\n", ".", " ", "")):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=list(separators)
+    )
+
+
+def check_fuzz(cases: int) -> None:
+    for seed in range(cases):
+        rng = random.Random(seed)
+        chunk_size = rng.choice([5, 10, 30, 100, 1000])
+        chunk_overlap = rng.randint(0, chunk_size // 2)
+        separators = rng.choice(FUZZ_SEPARATORS)
+        text = "".join(
+            rng.choice(FUZZ_PIECES) if rng.random() < 0.5 else "w" * rng.randint(1, chunk_size * 2)
+            for _ in range(rng.randint(0, 300))
+        )
+        expected = langchain_splitter(chunk_size, chunk_overlap, separators).split_text(text)
+        spans = TextChunker(chunk_size, chunk_overlap, separators).split_spans(text)
+        assert [text[start:end] for start, end in spans] == expected, f"чанки расходятся (seed {seed})"
+
+
+def check_stream_fuzz(cases: int) -> None:
+    """Потоковая нарезка при случайном разбиении текста на сегменты и разных размерах буфера."""
+    splitter = langchain_splitter()
+    pieces = FUZZ_PIECES + ["y" * 1200]
+    for seed in range(cases):
+        rng = random.Random(seed)
+        text = "".join(
+            rng.choice(pieces) if rng.random() < 0.6 else "w" * rng.randint(1, 200)
+            for _ in range(rng.randint(0, 800))
+        )
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 60))))
+        segments = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+        chunks = list(iter_chunk_spans(segments, buffer_chars=rng.choice([1, 100, 2000, 20000])))
+        assert [chunk for chunk, _, _ in chunks] == splitter.split_text(text), f"поток расходится (seed {seed})"
+        assert all(text[start:end] == chunk for chunk, start, end in chunks), f"смещения неверны (seed {seed})"
+
+
+def check_streaming(pages) -> None:
+    text = "".join(segment for _, segment in _separate_pages(enumerate(pages, start=1)))
+    chunks = list(iter_page_chunks(_separate_pages(enumerate(pages, start=1))))
+    assert [chunk for chunk, _, _, _ in chunks] == langchain_splitter().split_text(text), "потоковая нарезка расходится"
+    for chunk, start, end, _ in chunks:
+        assert text[start:end] == chunk, "смещения не указывают на текст чанка"
+
+
+def import_seconds(module: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    return float(subprocess.check_output([sys.executable, "-c", code], text=True))
+
+
+def measure(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--fuzz", type=int, default=2000)
+    args = parser.parse_args()
+
+    check_fuzz(args.fuzz)
+    check_stream_fuzz(args.fuzz // 5)
+    pages = generate_pages(max(1, args.paragraphs // 6))
+    check_streaming(pages)
+    text = generate_text(args.paragraphs)
+    assert text_splitter.split_text(text) == langchain_splitter().split_text(text), "чанки корпуса расходятся"
+    print(f"эквивалентность: {args.fuzz} случайных текстов, {args.fuzz // 5} потоковых и корпус совпадают")
+
+    splitter = langchain_splitter()
+    page_segments = list(_separate_pages(enumerate(pages, start=1)))
+    old_seconds = measure(lambda: splitter.split_text(text))
+    new_seconds = measure(lambda: text_splitter.split_text(text))
+    stream_seconds = measure(lambda: sum(1 for _ in iter_page_chunks(iter(page_segments))))
+
+    millions = len(text) / 1_000_000
+    print(f"текст: {millions:.1f} млн символов, чанков {len(text_splitter.split_spans(text))}")
+    print(f"langchain:           {old_seconds:7.3f} с ({millions / old_seconds:6.1f} млн симв/с)")
+    print(f"TextChunker:         {new_seconds:7.3f} с ({millions / new_seconds:6.1f} млн симв/с)")
+    print(f"TextChunker поток:   {stream_seconds:7.3f} с (по страницам, со смещениями и номерами страниц)")
+    print(f"ускорение: {old_seconds / new_seconds:.2f}x")
+    print(
+        f"импорт: langchain_text_splitters {import_seconds('langchain_text_splitters') * 1000:.0f} мс, "
+        f"services.chunker {import_seconds('services.chunker') * 1000:.0f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
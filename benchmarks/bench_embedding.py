@@ -0,0 +1,57 @@
+"""
+Бенчмарк пропускной способности эмбеддингов при индексации (чанков/сек).
+
+Сравнивает старый путь (dense_model.embed([chunk]) и sparse_model.embed([chunk])
+на каждый чанк) с пакетным embed_texts (как в воркерах пула индексации)
+на фиксированном синтетическом корпусе.
+
+Запуск: python -m benchmarks.bench_embedding [--paragraphs 400] [--batch-size 64] [--parallel N]
+"""
+import argparse
+import time
+
+from benchmarks.corpus import generate_text
+from services.embeddings import embedding_models
+from services.text_pipeline import embed_texts, text_splitter
+
+
+def old_path(chunks):
+    dense_model = embedding_models.dense()
+    sparse_model = embedding_models.sparse()
+    for chunk_text in chunks:
+        list(dense_model.embed([chunk_text]))[0]
+        list(sparse_model.embed([chunk_text]))[0]
+
+
+def new_path(chunks, batch_size, parallel):
+    embed_texts(chunks, batch_size=batch_size, parallel=parallel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paragraphs", type=int, default=400, help="размер корпуса в абзацах")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--parallel", type=int, default=None, help="процессы fastembed (0 — все ядра)")
+    args = parser.parse_args()
+
+    chunks = text_splitter.split_text(generate_text(args.paragraphs))
+    print(f"Корпус: {len(chunks)} чанков")
+
+    # Загрузка моделей не должна попадать в замер
+    embedding_models.warm_up()
+
+    started = time.perf_counter()
+    old_path(chunks)
+    old_rate = len(chunks) / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    new_path(chunks, args.batch_size, args.parallel)
+    new_rate = len(chunks) / (time.perf_counter() - started)
+
+    print(f"old (по одному чанку): {old_rate:8.1f} чанков/сек")
+    print(f"new (batch={args.batch_size}, parallel={args.parallel}): {new_rate:8.1f} чанков/сек")
+    print(f"ускорение: {new_rate / old_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Бенчмарк поиска: только dense против гибридного (dense + SPLADE со слиянием RRF/DBSF).
+
+Корпус — синтетические карточки товаров с уникальными артикулами и названиями
+поверх общих фраз FAQ (benchmarks.corpus). Для каждого запроса известна правильная
+карточка, поэтому считаются recall@k и MRR, а также задержка кодирования запроса
+и самого query_points. Запросы строятся так же, как в services.search_service.
+
+По умолчанию используется встроенный Qdrant (:memory:): задержки в нем не равны
+серверным, но сравнение режимов между собой корректно. Для замера на реальном узле
+передайте --url. Нужны модели fastembed (скачиваются при первом запуске).
+
+Запуск: python -m benchmarks.bench_hybrid_search [--cards 500] [--queries 200] [--limit 5] [--url http://localhost:6333]
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+from qdrant_client import AsyncQdrantClient, models
+
+from benchmarks.corpus import ASCII_SENTENCES
+from services.search_service import SPARSE_VECTOR_NAME, build_search_request, encode_query, query_embedding_cache
+from services.text_pipeline import embed_texts
+
+COLLECTION = "bench_hybrid_search"
+ADJECTIVES = ["compact", "silent", "heavy-duty", "wireless", "smart", "portable", "industrial", "classic"]
+PRODUCTS = ["drill", "kettle", "router", "vacuum cleaner", "heater", "blender", "projector", "scanner"]
+QUESTIONS = [
+    "What is the warranty for {code}?",
+    "Can I return the {code} if it arrives damaged?",
+    "{code} delivery time",
+    "How much does the {name} cost?",
+]
+
+
+def generate_cards(count: int, seed: int = 42) -> List[Tuple[str, str, str]]:
+    """Возвращает (артикул, название, текст карточки)."""
+    rng = random.Random(seed)
+    codes = rng.sample(range(1000, 10000), count)
+    cards = []
+    for number in codes:
+        code = f"{rng.choice('ABCDKMRTXZ')}{rng.choice('ABCDKMRTXZ')}-{number}"
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(PRODUCTS)} {code}"
+        facts = " ".join(rng.choice(ASCII_SENTENCES) for _ in range(rng.randint(3, 6)))
+        cards.append((code, name, f"Product card: {name}. Article {code}. {facts}"))
+    return cards
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def index_cards(client: AsyncQdrantClient, cards: List[Tuple[str, str, str]], batch_size: int = 64) -> None:
+    if await client.collection_exists(COLLECTION):
+        await client.delete_collection(COLLECTION)
+    await client.create_collection(
+        collection_name=COLLECTION,
+        vectors_config=models.VectorParams(size=384, distance=models.Distance.COSINE),
+        sparse_vectors_config={SPARSE_VECTOR_NAME: models.SparseVectorParams()}
+    )
+    for start in range(0, len(cards), batch_size):
+        batch = cards[start:start + batch_size]
+        vectors = embed_texts([text for _, _, text in batch], batch_size=batch_size)
+        points = [
+            models.PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_DNS, code)),
+                vector={
+                    "": dense,
+                    SPARSE_VECTOR_NAME: models.SparseVector(indices=indices, values=values)
+                },
+                payload={"agent_id": 1, "code": code}
+            )
+            for (code, _, _), (dense, indices, values) in zip(batch, vectors)
+        ]
+        await client.upsert(collection_name=COLLECTION, points=points)
+
+
+async def run_mode(
+    client: AsyncQdrantClient,
+    queries: List[Tuple[str, str]],
+    limit: int,
+    hybrid: bool,
+    fusion: str,
+    prefetch_limit: int
+) -> Dict[str, float]:
+    query_filter = models.Filter(must=[models.FieldCondition(key="agent_id", match=models.MatchValue(value=1))])
+    encode_times: List[float] = []
+    query_times: List[float] = []
+    hits = 0
+    reciprocal_ranks = 0.0
+    for query, expected_code in queries:
+        started = time.perf_counter()
+        dense_vector, sparse_vector = encode_query(query, hybrid)
+        encoded = time.perf_counter()
+        response = await client.query_points(
+            collection_name=COLLECTION,
+            with_payload=True,
+            **build_search_request(dense_vector, sparse_vector, query_filter, limit, fusion, prefetch_limit)
+        )
+        query_times.append(time.perf_counter() - encoded)
+        encode_times.append(encoded - started)
+
+        codes = [point.payload["code"] for point in response.points]
+        if expected_code in codes:
+            hits += 1
+            reciprocal_ranks += 1 / (codes.index(expected_code) + 1)
+    return {
+        "recall": hits / len(queries),
+        "mrr": reciprocal_ranks / len(queries),
+        "encode_p50": percentile(encode_times, 0.5) * 1000,
+        "query_p50": percentile(query_times, 0.5) * 1000,
+        "query_p95": percentile(query_times, 0.95) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--prefetch-limit", type=int, default=20)
+    parser.add_argument("--url", default=None, help="Qdrant URL; по умолчанию встроенный :memory:")
+    args = parser.parse_args()
+
+    client = AsyncQdrantClient(url=args.url) if args.url else AsyncQdrantClient(":memory:")
+    cards = generate_cards(args.cards)
+    rng = random.Random(7)
+    queries = []
+    for code, name, _ in rng.sample(cards, min(args.queries, len(cards))):
+        queries.append((rng.choice(QUESTIONS).format(code=code, name=name), code))
+
+    started = time.perf_counter()
+    await index_cards(client, cards)
+    print(f"Карточек: {len(cards)}, запросов: {len(queries)}, индексация {time.perf_counter() - started:.1f} с")
+
+    # Прогрев: первая загрузка моделей не должна попадать в замер
+    encode_query("warm up", hybrid=True)
+
+    modes = [("dense", False, "rrf"), ("hybrid rrf", True, "rrf"), ("hybrid dbsf", True, "dbsf")]
+    print(f"{'режим':<12} {'recall@' + str(args.limit):>9} {'MRR':>6} {'encode p50':>11} {'query p50':>10} {'query p95':>10}")
+    for label, hybrid, fusion in modes:
+        # Кэш эмбеддингов запросов сбрасывается, чтобы режимы кодировали запросы одинаково «с нуля»
+        query_embedding_cache.clear()
+        result = await run_mode(client, queries, args.limit, hybrid, fusion, args.prefetch_limit)
+        print(
+            f"{label:<12} {result['recall']:>9.3f} {result['mrr']:>6.3f} {result['encode_p50']:>8.1f} мс "
+            f"{result['query_p50']:>7.1f} мс {result['query_p95']:>7.1f} мс"
+        )
+
+    if args.url:
+        await client.delete_collection(COLLECTION)
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
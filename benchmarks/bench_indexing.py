@@ -0,0 +1,218 @@
+"""
+Бенчмарк конвейера индексации в том виде, в каком он работает в проде:
+prepare_document (извлечение и нарезка в артефакт) -> stream_document_batches
+(эмбеддинги в пуле процессов, потоково через ограниченную очередь) -> PointUploader.
+
+Корпуса PDF, DOCX и TXT заданного размера генерируются локально (benchmarks.corpus),
+Qdrant — встроенный (:memory:), поэтому бенчмарк работает без сети и сервисов
+(кроме моделей fastembed, которые скачиваются при первом запуске). Каждый формат
+прогоняется в отдельном процессе со своим пулом индексации, чтобы пиковая память
+не смешивалась между форматами; загрузка моделей воркерами в замер не входит.
+Кэш эмбеддингов выключен.
+
+Для каждого формата печатается время этапов (embed и upsert идут конвейером
+и пересекаются, total — реальное время), чанков/сек и пиковый RSS: процесса
+с event loop и самого тяжелого воркера пула (он и показывает, ограничена ли память
+размером буфера и очереди, а не размером файла). При наличии сохраненного baseline
+печатается отклонение от него. Если какой-то показатель хуже baseline больше чем
+на --tolerance, скрипт завершается с кодом 1 (удобно перед деплоем).
+
+Запуск:
+  python -m benchmarks.bench_indexing --save-baseline     # записать baseline на целевой машине
+  python -m benchmarks.bench_indexing                     # сравнить с ним
+  [--formats pdf,docx,txt] [--pdf-pages 100] [--docx-paragraphs 3000] [--txt-paragraphs 6000]
+  [--workers 2] [--baseline benchmarks/indexing_baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
+from typing import Any, Dict, List
+
+STAGES = ["extract", "split", "embed", "upsert", "total"]
+COLLECTION = "bench_indexing"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "indexing_baseline.json")
+# Разница во времени этапа меньше этой считается шумом, а не регрессией
+MIN_DELTA_SECONDS = 0.05
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # На Linux ru_maxrss в килобайтах; для RUSAGE_CHILDREN — максимум по завершенным дочерним процессам
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def generate_corpus(fmt: str, size: int, directory: str) -> str:
+    from benchmarks.corpus import ASCII_SENTENCES, generate_pages, generate_paragraphs, write_docx, write_pdf
+
+    path = os.path.join(directory, f"corpus.{fmt}")
+    if fmt == "pdf":
+        write_pdf(path, generate_pages(size, sentences=ASCII_SENTENCES))
+    elif fmt == "docx":
+        write_docx(path, generate_paragraphs(size))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(generate_paragraphs(size)))
+    return path
+
+
+async def index_corpus(path: str) -> Dict[str, Any]:
+    """Индексирует файл теми же функциями, что и process_document, и возвращает время этапов."""
+    from qdrant_client import AsyncQdrantClient, models
+
+    from services.index_executor import get_index_workers, run_in_index_pool
+    from services.indexer import build_point, prepare_document, stream_document_batches
+    from services.qdrant_writer import PointUploader
+
+    # Прогрев: воркеры пула стартуют и загружают модели до начала замера
+    await asyncio.gather(*[run_in_index_pool(time.sleep, 1) for _ in range(get_index_workers())])
+
+    client = AsyncQdrantClient(":memory:")
+    await client.create_collection(
+        collection_name=COLLECTION,
+        vectors_config=models.VectorParams(size=384, distance=models.Distance.COSINE),
+        sparse_vectors_config={"sparse-text": models.SparseVectorParams()}
+    )
+    uploader = PointUploader(COLLECTION, client=client)
+    seconds: Dict[str, float] = {}
+
+    started = time.perf_counter()
+    chunks, timings = await prepare_document(path)
+    seconds["extract"] = timings["extract"]
+    seconds["split"] = timings["split"]
+
+    embed_seconds = 0.0
+    unique = 0
+    async with aclosing(stream_document_batches(path)) as batches:
+        async for batch, vectors, batch_embed_seconds in batches:
+            embed_seconds += batch_embed_seconds
+            # Вектор None — повтор чанка внутри файла, точка у него та же
+            points = [
+                build_point(text, chunk_vectors, text_hash, 1, 1, "corpus", page)
+                for (text, page, text_hash), chunk_vectors in zip(batch, vectors)
+                if chunk_vectors is not None
+            ]
+            unique += len(points)
+            if points:
+                await uploader.add(points)
+    await uploader.flush()
+    seconds["embed"] = embed_seconds
+    seconds["upsert"] = uploader.busy_seconds
+    seconds["total"] = time.perf_counter() - started
+
+    assert (await client.count(COLLECTION)).count == unique
+    await client.close()
+    return {"chunks": chunks, "seconds": seconds}
+
+
+def run_format(fmt: str, size: int) -> Dict[str, Any]:
+    """Выполняется в отдельном процессе: один формат, свой пул индексации."""
+    from services.index_executor import shutdown_index_executor
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = generate_corpus(fmt, size, directory)
+        file_mb = os.path.getsize(path) / 1024 / 1024
+        try:
+            result = asyncio.run(index_corpus(path))
+        finally:
+            # Воркеры завершаются, и их пиковая память попадает в RUSAGE_CHILDREN
+            shutdown_index_executor(wait=True)
+
+    seconds = result["seconds"]
+    return {
+        "size": size,
+        "file_mb": round(file_mb, 2),
+        "chunks": result["chunks"],
+        "seconds": {stage: round(value, 4) for stage, value in seconds.items()},
+        "chunks_per_second": round(result["chunks"] / seconds["total"], 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "worker_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+
+def compare(fmt: str, current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Печатает отклонения от baseline и возвращает список регрессий."""
+    if baseline.get("size") != current["size"]:
+        print(f"  baseline для {fmt} снят на другом размере корпуса — сравнение пропущено")
+        return []
+    regressions = []
+    rows = [
+        (f"{stage}, с", current["seconds"][stage], baseline["seconds"][stage], False, MIN_DELTA_SECONDS)
+        for stage in STAGES
+    ]
+    rows.append(("чанков/сек", current["chunks_per_second"], baseline["chunks_per_second"], True, 0))
+    rows.append(("пик RSS, МБ", current["peak_rss_mb"], baseline["peak_rss_mb"], False, 0))
+    rows.append(("пик RSS пула, МБ", current["worker_peak_rss_mb"], baseline.get("worker_peak_rss_mb"), False, 0))
+    for label, value, base, higher_is_better, min_delta in rows:
+        if not base:
+            continue
+        change = value / base - 1
+        worse = -change if higher_is_better else change
+        marker = "  <-- регрессия" if worse > tolerance and abs(value - base) > min_delta else ""
+        print(f"  {label:<16} {value:>10.3f}  baseline {base:>10.3f}  {change:+7.1%}{marker}")
+        if marker:
+            regressions.append(f"{fmt}: {label} {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", default="pdf,docx,txt")
+    parser.add_argument("--pdf-pages", type=int, default=100)
+    parser.add_argument("--docx-paragraphs", type=int, default=3000)
+    parser.add_argument("--txt-paragraphs", type=int, default=6000)
+    parser.add_argument("--workers", type=int, default=None, help="размер пула индексации (по умолчанию INDEX_WORKERS)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Настройки читаются процессами форматов и воркерами пула из окружения
+    os.environ["EMBED_CACHE_PATH"] = ""
+    if args.workers:
+        os.environ["INDEX_WORKERS"] = str(args.workers)
+
+    sizes = {"pdf": args.pdf_pages, "docx": args.docx_paragraphs, "txt": args.txt_paragraphs}
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    regressions: List[str] = []
+    for fmt in formats:
+        # Новый процесс на формат: чистый пиковый RSS и холодные кэши
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_format, fmt, sizes[fmt]).result()
+        results[fmt] = result
+
+        stages = "  ".join(f"{stage} {result['seconds'][stage]:.2f} с" for stage in STAGES)
+        print(
+            f"{fmt.upper():<5} {result['file_mb']:.1f} МБ, {result['chunks']} чанков: {stages}, "
+            f"{result['chunks_per_second']} чанков/сек, пик RSS {result['peak_rss_mb']} МБ, "
+            f"воркера пула {result['worker_peak_rss_mb']} МБ"
+        )
+        if fmt in baseline:
+            regressions += compare(fmt, result, baseline[fmt], args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранен: {args.baseline}")
+    elif not baseline:
+        print(f"Baseline не найден ({args.baseline}), запустите с --save-baseline")
+
+    if regressions:
+        print("Регрессии: " + "; ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
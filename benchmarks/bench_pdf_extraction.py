@@ -0,0 +1,68 @@
+"""
+Бенчмарк извлечения текста из больших PDF: последовательный обход страниц
+против параллельного извлечения диапазонами страниц в пуле процессов.
+
+PDF генерируется локально (benchmarks.corpus.write_pdf). Перед замером
+проверяется, что оба пути дают одинаковый текст и одинаковые номера страниц чанков.
+
+Запуск: python -m benchmarks.bench_pdf_extraction [--pages 300] [--workers N] [--pages-per-shard 20]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpus import ASCII_SENTENCES, generate_pages, write_pdf
+from services.text_pipeline import (
+    _separate_pages, extract_pdf_shard, extract_text_sync, iter_located_chunks, iter_page_segments,
+    iter_shard_pages
+)
+
+
+def parallel_shards(executor, file_path, pages, per_shard):
+    futures = []
+    for start in range(0, pages, per_shard):
+        end = min(start + per_shard, pages)
+        futures.append(executor.submit(extract_pdf_shard, file_path, start, end, f"{file_path}.pages-{start}-{end}.jsonl"))
+    return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages-per-shard", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "manual.pdf")
+        write_pdf(file_path, generate_pages(args.pages, sentences=ASCII_SENTENCES))
+        print(f"PDF: {args.pages} страниц, {os.path.getsize(file_path) / 1024:.0f} КБ, воркеров {args.workers}")
+
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            # Прогрев пула (spawn и импорты) не должен попадать в замер
+            list(executor.map(abs, range(args.workers)))
+
+            started = time.perf_counter()
+            serial_text = extract_text_sync(file_path)
+            serial_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            shard_paths = parallel_shards(executor, file_path, args.pages, args.pages_per_shard)
+            parallel_text = "".join(segment for _, segment in _separate_pages(iter_shard_pages(shard_paths)))
+            parallel_seconds = time.perf_counter() - started
+
+        assert parallel_text == serial_text, "параллельное извлечение дало другой текст"
+        serial_chunks = list(iter_located_chunks(iter_page_segments(file_path)))
+        parallel_chunks = list(iter_located_chunks(_separate_pages(iter_shard_pages(shard_paths))))
+        assert parallel_chunks == serial_chunks, "номера страниц чанков не совпадают"
+
+    print(f"последовательно: {serial_seconds:7.2f} с ({args.pages / serial_seconds:6.1f} стр/сек)")
+    print(f"параллельно:     {parallel_seconds:7.2f} с ({args.pages / parallel_seconds:6.1f} стр/сек)")
+    print(f"ускорение: {serial_seconds / parallel_seconds:.2f}x, чанков {len(serial_chunks)}")
+
+
+if __name__ == "__main__":
+    main()
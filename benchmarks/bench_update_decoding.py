@@ -0,0 +1,131 @@
+"""
+Микробенчмарк декодирования апдейтов вебхука.
+
+Сравнивает старый путь (json -> dict -> Update(**data) + перемонтирование к боту
+внутри feed_update) с новым decode_update (model_validate_json с контекстом бота)
+на типичных формах апдейтов Telegram. Результат — апдейтов/сек на одно ядро.
+
+Запуск: python -m benchmarks.bench_update_decoding [--seconds 2]
+"""
+import argparse
+import json
+import time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from core.updates import decode_update
+
+try:
+    import orjson
+except ImportError:  # orjson не входит в requirements, вариант необязателен
+    orjson = None
+
+USER = {"id": 123456789, "is_bot": False, "first_name": "Иван", "username": "ivan_petrov", "language_code": "ru"}
+CHAT = {"id": 123456789, "first_name": "Иван", "username": "ivan_petrov", "type": "private"}
+
+PAYLOADS = {
+    "text": {
+        "update_id": 900000001,
+        "message": {
+            "message_id": 4021,
+            "from": USER,
+            "chat": CHAT,
+            "date": 1760000000,
+            "text": "Подскажите, пожалуйста, какие у вас часы работы в выходные?"
+        }
+    },
+    "document": {
+        "update_id": 900000002,
+        "message": {
+            "message_id": 4022,
+            "from": USER,
+            "chat": CHAT,
+            "date": 1760000001,
+            "document": {
+                "file_name": "price_list_2025.pdf",
+                "mime_type": "application/pdf",
+                "file_id": "BQACAgIAAxkBAAIBY2Zx7example_file_id_AAQ",
+                "file_unique_id": "AgADexample",
+                "file_size": 1843221
+            },
+            "caption": "Актуальный прайс"
+        }
+    },
+    "callback_query": {
+        "update_id": 900000003,
+        "callback_query": {
+            "id": "4382bfdwdsb323b2d9",
+            "from": USER,
+            "chat_instance": "-8823674287234",
+            "data": "agent_info_42",
+            "message": {
+                "message_id": 4023,
+                "from": {"id": 7000000001, "is_bot": True, "first_name": "Master", "username": "master_bot"},
+                "chat": CHAT,
+                "date": 1760000002,
+                "text": "🤖 Ваши агенты:",
+                "reply_markup": {
+                    "inline_keyboard": [
+                        [{"text": "🟢 @shop_helper_bot", "callback_data": "agent_info_42"}],
+                        [{"text": "⬅️ Назад в меню", "callback_data": "start_menu"}]
+                    ]
+                }
+            }
+        }
+    }
+}
+
+
+def old_path(raw: bytes, bot: Bot) -> Update:
+    # Так было в main.py: request.json() + Update(**data), а затем feed_update
+    # перемонтировал апдейт к боту через model_dump/model_validate
+    update = Update(**json.loads(raw))
+    if update.bot != bot:
+        update = Update.model_validate(update.model_dump(), context={"bot": bot})
+    return update
+
+
+def orjson_path(raw: bytes, bot: Bot) -> Update:
+    return Update.model_validate(orjson.loads(raw), context={"bot": bot})
+
+
+def new_path(raw: bytes, bot: Bot) -> Update:
+    return decode_update(raw, bot)
+
+
+def measure(fn, raw: bytes, bot: Bot, seconds: float) -> float:
+    count = 0
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn(raw, bot)
+        count += 100
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2.0, help="время замера на каждый вариант")
+    args = parser.parse_args()
+
+    bot = Bot(token="123456:BENCHMARKbenchmarkBENCHMARKbench")
+    paths = {"old": old_path, "orjson": orjson_path, "new": new_path}
+    if orjson is None:
+        del paths["orjson"]
+
+    print(f"{'payload':<16}" + "".join(f"{name:>14}" for name in paths) + f"{'speedup':>10}")
+    for payload_name, payload in PAYLOADS.items():
+        raw = json.dumps(payload, ensure_ascii=False).encode()
+        # Все варианты должны давать одинаковый апдейт
+        assert all(fn(raw, bot) == new_path(raw, bot) for fn in paths.values())
+
+        rates = {name: measure(fn, raw, bot, args.seconds) for name, fn in paths.items()}
+        speedup = rates["new"] / rates["old"]
+        print(f"{payload_name:<16}" + "".join(f"{rate:>14,.0f}" for rate in rates.values()) + f"{speedup:>9.2f}x")
+    print("(апдейтов/сек на одно ядро)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Детерминированный синтетический корпус для бенчмарков индексации."""
+import random
+import textwrap
+from typing import List
+
+SENTENCES = [
+    "Наш магазин работает ежедневно с 9:00 до 21:00 без перерывов и выходных.",
+    "Доставка по городу занимает от одного до трех рабочих дней в зависимости от района.",
+    "Возврат товара надлежащего качества возможен в течение четырнадцати дней с момента покупки.",
+    "Для оформления заказа укажите имя, телефон и адрес доставки в форме на сайте.",
+    "Гарантийный срок на электронику составляет двенадцать месяцев с даты продажи.",
+    "Our support team answers questions about pricing, delivery and refunds within one hour.",
+    "The Pro plan includes unlimited knowledge base chunks and priority processing.",
+    "Оплата принимается банковскими картами, через СБП и наличными при получении.",
+    "Скидка для постоянных клиентов составляет пять процентов на все позиции каталога.",
+    "If the package arrives damaged, take a photo and contact the courier immediately.",
+    "Сервисный центр находится по адресу: улица Ленина, дом 10, вход со двора.",
+    "Подробные технические характеристики приведены в таблице в конце раздела.",
+]
+
+# Стандартные шрифты PDF не содержат кириллицы, поэтому PDF-корпус собирается из латиницы
+ASCII_SENTENCES = [
+    "Our support team answers questions about pricing, delivery and refunds within one hour.",
+    "The Pro plan includes unlimited knowledge base chunks and priority processing.",
+    "If the package arrives damaged, take a photo and contact the courier immediately.",
+    "The store is open every day from 9 am to 9 pm without breaks or days off.",
+    "Delivery within the city takes from one to three business days depending on the district.",
+    "Goods of proper quality can be returned within fourteen days from the date of purchase.",
+    "The warranty period for electronics is twelve months from the date of sale.",
+    "Detailed technical specifications are given in the table at the end of the section.",
+]
+
+
+def generate_paragraphs(count: int, seed: int = 42, sentences: List[str] = SENTENCES) -> List[str]:
+    """Возвращает count абзацев по 3-8 предложений (одинаковых при одном seed)."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(sentences) for _ in range(rng.randint(3, 8)))
+        for _ in range(count)
+    ]
+
+
+def generate_pages(
+    pages: int,
+    paragraphs_per_page: int = 6,
+    seed: int = 42,
+    sentences: List[str] = SENTENCES
+) -> List[str]:
+    """Возвращает тексты страниц документа."""
+    paragraphs = generate_paragraphs(pages * paragraphs_per_page, seed=seed, sentences=sentences)
+    return [
+        "\n\n".join(paragraphs[i:i + paragraphs_per_page])
+        for i in range(0, len(paragraphs), paragraphs_per_page)
+    ]
+
+
+def generate_text(paragraphs: int, seed: int = 42) -> str:
+    return "\n\n".join(generate_paragraphs(paragraphs, seed=seed))
+
+
+def write_docx(path: str, paragraphs: List[str]) -> None:
+    from docx import Document
+
+    doc = Document()
+    for paragraph in paragraphs:
+        doc.add_paragraph(paragraph)
+    doc.save(path)
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[str], line_width: int = 95) -> None:
+    """
+    Пишет минимальный текстовый PDF (Helvetica, A4): одна страница на элемент pages.
+    Зависимостей нет, поэтому большие PDF для бенчмарков генерируются локально.
+    """
+    page_count = len(pages)
+    font_id = 3 + 2 * page_count
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        (
+            "<< /Type /Pages /Kids [" + " ".join(f"{3 + 2 * i} 0 R" for i in range(page_count))
+            + f"] /Count {page_count} >>"
+        ).encode()
+    ]
+    for i, text in enumerate(pages):
+        lines = []
+        for paragraph in text.split("\n\n"):
+            lines.extend(textwrap.wrap(paragraph, line_width))
+            lines.append("")
+        commands = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        commands += [f"({_pdf_escape(line)}) Tj T*" for line in lines]
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1", "replace")
+        objects.append(
+            (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * i} 0 R >>"
+            ).encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
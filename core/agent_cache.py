@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from core.config import settings
+from database.db import async_session
+from database.models import Agent
+
+
+class AgentConfigCache:
+    """
+    TTL-кэш конфигурации агентов для входящих апдейтов.
+
+    Вебхук и AgentContextMiddleware читают настройки агента отсюда, поэтому
+    «горячий» агент отвечает без обращений к Postgres. Мастер-хендлеры,
+    меняющие настройки, обязаны вызывать invalidate/invalidate_owner.
+
+    Размер ограничен max_size по принципу LRU: промахи по несуществующим bot_id
+    тоже кэшируются, и запросы на случайные /webhook/{bot_id} не должны раздувать память.
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # agent_id -> (конфиг или None, если агента нет, время истечения)
+        self._entries: "OrderedDict[int, Tuple[Optional[Dict[str, Any]], float]]" = OrderedDict()
+
+    async def get(self, agent_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает конфиг агента, загружая его из БД при промахе."""
+        now = time.monotonic()
+        entry = self._entries.get(agent_id)
+        if entry:
+            if entry[1] > now:
+                self._entries.move_to_end(agent_id)
+                return entry[0]
+            del self._entries[agent_id]
+
+        async with async_session() as session:
+            result = await session.execute(
+                select(Agent).options(joinedload(Agent.owner)).where(Agent.id == agent_id)
+            )
+            agent = result.scalar_one_or_none()
+
+        config = None
+        if agent:
+            config = {
+                "id": agent.id,
+                "owner_telegram_id": agent.owner.telegram_id,
+                "system_prompt": agent.system_prompt,
+                "welcome_message": agent.welcome_message,
+                "is_active": agent.is_active,
+                "subscription_type": agent.owner.subscription_type,
+                "subscription_end_date": agent.owner.subscription_end_date,
+                "encrypted_token": agent.encrypted_token
+            }
+
+        # Отсутствующих агентов тоже кэшируем, чтобы чужие запросы не били в БД
+        self._put(agent_id, config)
+        return config
+
+    def _put(self, agent_id: int, config: Optional[Dict[str, Any]]) -> None:
+        now = time.monotonic()
+        self._entries.pop(agent_id, None)
+        # Истекшие записи в начале (давно не использованные) убираем сразу
+        while self._entries:
+            expires_at = next(iter(self._entries.values()))[1]
+            if expires_at > now:
+                break
+            self._entries.popitem(last=False)
+        if len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+        self._entries[agent_id] = (config, now + self.ttl)
+
+    def invalidate(self, agent_id: int) -> None:
+        self._entries.pop(agent_id, None)
+
+    def invalidate_owner(self, owner_telegram_id: int) -> None:
+        """Сбрасывает конфиги всех агентов владельца (например, после смены тарифа)."""
+        for agent_id, (config, _) in list(self._entries.items()):
+            if config and config["owner_telegram_id"] == owner_telegram_id:
+                self._entries.pop(agent_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "max_size": self.max_size}
+
+
+agent_config_cache = AgentConfigCache(ttl=settings.AGENT_CACHE_TTL, max_size=settings.AGENT_CACHE_MAX_SIZE)
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from core.config import settings
+from core.crypto import decrypt_token
+
+
+class AgentBotPool:
+    """
+    LRU-пул долгоживущих Bot-объектов агентов.
+
+    Все боты используют одну AiohttpSession (один коннектор и пул TCP/TLS соединений
+    к api.telegram.org), поэтому токен расшифровывается и соединение открывается
+    только при первом обращении к агенту, а не на каждый апдейт.
+    """
+
+    def __init__(self, max_size: int, idle_ttl: int):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.session = AiohttpSession()
+        # agent_id -> (bot, время последнего использования)
+        self._bots: "OrderedDict[int, Tuple[Bot, float]]" = OrderedDict()
+
+    def get(self, agent_id: int, encrypted_token: str) -> Bot:
+        """Возвращает бота агента из пула, создавая его при необходимости."""
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        entry = self._bots.get(agent_id)
+        if entry:
+            bot = entry[0]
+            self._bots.move_to_end(agent_id)
+        else:
+            bot = Bot(token=decrypt_token(encrypted_token), session=self.session)
+            if len(self._bots) >= self.max_size:
+                # Вытесняем самого давно не использованного агента
+                self._bots.popitem(last=False)
+
+        self._bots[agent_id] = (bot, now)
+        return bot
+
+    def invalidate(self, agent_id: int) -> None:
+        """Удаляет бота агента из пула (смена статуса, удаление агента)."""
+        self._bots.pop(agent_id, None)
+
+    def _evict_idle(self, now: float) -> None:
+        # Записи упорядочены по времени использования, поэтому idle-боты всегда в начале
+        while self._bots:
+            last_used = next(iter(self._bots.values()))[1]
+            if now - last_used < self.idle_ttl:
+                break
+            self._bots.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._bots), "max_size": self.max_size}
+
+    async def close(self) -> None:
+        """Закрывает общую HTTP-сессию всех ботов пула."""
+        self._bots.clear()
+        await self.session.close()
+
+
+agent_bot_pool = AgentBotPool(
+    max_size=settings.BOT_POOL_MAX_SIZE,
+    idle_ttl=settings.BOT_POOL_IDLE_TTL
+)
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 from qdrant_client import AsyncQdrantClient
 
@@ -9,13 +10,93 @@ class Settings:
     ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
     QDRANT_URL = os.getenv("QDRANT_URL")
     QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", "")
+    QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))  # секунд
+    QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() in ("1", "true", "yes")
+    QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
     DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY") 
     BASE_URL = os.getenv("BASE_URL")
     MASTER_BOT_TOKEN = os.getenv("MASTER_BOT_TOKEN")
 
+    # Пул долгоживущих Bot-объектов агентов
+    BOT_POOL_MAX_SIZE = int(os.getenv("BOT_POOL_MAX_SIZE", "500"))
+    BOT_POOL_IDLE_TTL = int(os.getenv("BOT_POOL_IDLE_TTL", "900"))  # секунд
+
+    # Кэш конфигурации агентов на пути входящих апдейтов
+    AGENT_CACHE_TTL = int(os.getenv("AGENT_CACHE_TTL", "60"))  # секунд
+    # Предел записей кэша (включая промахи по несуществующим bot_id), дальше — вытеснение LRU
+    AGENT_CACHE_MAX_SIZE = int(os.getenv("AGENT_CACHE_MAX_SIZE", "10000"))
+
+    # Режим быстрого ответа вебхука: апдейт ставится в очередь, 200 уходит сразу
+    WEBHOOK_FAST_ACK = os.getenv("WEBHOOK_FAST_ACK", "false").lower() in ("1", "true", "yes")
+    UPDATE_QUEUE_WORKERS = int(os.getenv("UPDATE_QUEUE_WORKERS", "32"))
+    UPDATE_QUEUE_MAX_SIZE = int(os.getenv("UPDATE_QUEUE_MAX_SIZE", "5000"))
+    AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))
+
+    # Общий лимит одновременных запросов поиск + LLM (распределяется между агентами по тарифам)
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+    # Дедупликация повторных доставок апдейтов (последние N update_id на бота)
+    UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "1000"))
+    UPDATE_DEDUP_MAX_BOTS = int(os.getenv("UPDATE_DEDUP_MAX_BOTS", "10000"))
+
+    # Фоновый прогрев моделей эмбеддингов при старте (иначе — загрузка при первом обращении)
+    EMBEDDINGS_WARMUP = os.getenv("EMBEDDINGS_WARMUP", "true").lower() in ("1", "true", "yes")
+
+    # Сверка вебхуков активных агентов при старте
+    WEBHOOK_RECONCILE_ON_STARTUP = os.getenv("WEBHOOK_RECONCILE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+    WEBHOOK_RECONCILE_CONCURRENCY = int(os.getenv("WEBHOOK_RECONCILE_CONCURRENCY", "10"))
+
+    # Пакетная генерация эмбеддингов при индексации (параллельность дает пул индексации)
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+    # Пул процессов индексации (извлечение текста, нарезка, эмбеддинги). 0 — по числу ядер.
+    INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "0"))
+    # Сколько готовых пачек эмбеддингов может ждать загрузки в Qdrant (ограничивает память)
+    INDEX_STREAM_QUEUE_SIZE = int(os.getenv("INDEX_STREAM_QUEUE_SIZE", "4"))
+    # Большие PDF извлекаются параллельно диапазонами по столько страниц
+    PDF_PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "20"))
+
+    # Кэш эмбеддингов чанков (SQLite, общий для воркеров пула). Пустой путь — кэш выключен.
+    # По умолчанию вне каталога проекта: база до EMBED_CACHE_MAX_MB не должна попадать в исходники
+    EMBED_CACHE_PATH = os.getenv(
+        "EMBED_CACHE_PATH", os.path.expanduser("~/.cache/ai-agent-factory/embeddings.sqlite3")
+    )
+    EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "1024"))
+
+    # Загрузка точек в Qdrant: размер одного upsert, сколько пачек в полете одновременно
+    # и сколько раз повторять пачку при ошибке. При QDRANT_UPSERT_WAIT=false пачки не ждут
+    # индексации на стороне Qdrant, а видимость всех точек обеспечивает финальный барьер
+    QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "256"))
+    QDRANT_UPSERT_IN_FLIGHT = int(os.getenv("QDRANT_UPSERT_IN_FLIGHT", "4"))
+    QDRANT_UPSERT_RETRIES = int(os.getenv("QDRANT_UPSERT_RETRIES", "3"))
+    QDRANT_UPSERT_WAIT = os.getenv("QDRANT_UPSERT_WAIT", "false").lower() in ("1", "true", "yes")
+
+    # Поиск по базе знаний: hybrid — dense + SPLADE со слиянием в Qdrant, dense — только dense.
+    # SEARCH_FUSION: rrf или dbsf. SEARCH_PREFETCH_LIMIT — кандидатов из каждой ветки до слияния.
+    # query_points с prefetch и слиянием (Query API, DBSF) требует сервер Qdrant >= 1.11
+    SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid").lower()
+    SEARCH_FUSION = os.getenv("SEARCH_FUSION", "rrf").lower()
+    SEARCH_PREFETCH_LIMIT = int(os.getenv("SEARCH_PREFETCH_LIMIT", "20"))
+    # LRU-кэш эмбеддингов запросов (общий для всех агентов). 0 — кэш выключен
+    QUERY_EMBED_CACHE_MB = int(os.getenv("QUERY_EMBED_CACHE_MB", "32"))
+
+    # Очередь задач индексации в Postgres. INDEX_JOB_CONCURRENCY: 0 — по размеру пула индексации.
+    INDEX_JOB_CONCURRENCY = int(os.getenv("INDEX_JOB_CONCURRENCY", "0"))
+    INDEX_JOB_MAX_ATTEMPTS = int(os.getenv("INDEX_JOB_MAX_ATTEMPTS", "3"))
+    INDEX_JOB_RETRY_DELAY = int(os.getenv("INDEX_JOB_RETRY_DELAY", "30"))  # секунд, удваивается с каждой попыткой
+    INDEX_JOB_LEASE = int(os.getenv("INDEX_JOB_LEASE", "300"))  # секунд без heartbeat до повторной выдачи задачи
+    INDEX_JOB_POLL_INTERVAL = float(os.getenv("INDEX_JOB_POLL_INTERVAL", "5"))  # секунд
+    # Узел, на диске которого лежат загруженные файлы (temp_uploads) и артефакты нарезки:
+    # задачу индексации выполняет только он. Имя должно переживать перезапуск контейнера
+    INDEX_NODE_ID = os.getenv("INDEX_NODE_ID") or socket.gethostname()
+
 settings = Settings()
 
+# Единый асинхронный клиент Qdrant для индексатора, поиска и старта приложения
 q_client = AsyncQdrantClient(
     url=settings.QDRANT_URL, 
-    api_key=settings.QDRANT_API_KEY
+    api_key=settings.QDRANT_API_KEY or None,
+    timeout=settings.QDRANT_TIMEOUT,
+    prefer_grpc=settings.QDRANT_PREFER_GRPC,
+    grpc_port=settings.QDRANT_GRPC_PORT
 )
\ No newline at end of file
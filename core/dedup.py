@@ -0,0 +1,63 @@
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Set, Tuple
+
+from core.config import settings
+
+
+class UpdateDeduplicator:
+    """
+    Отсекает повторные доставки апдейтов Telegram по update_id.
+
+    Для каждого бота хранится кольцевой буфер последних window идентификаторов
+    (deque + set для O(1) проверки). Число ботов ограничено max_bots по принципу LRU,
+    поэтому память ограничена при любом числе агентов.
+    """
+
+    def __init__(self, window: int, max_bots: int):
+        self.window = window
+        self.max_bots = max_bots
+        self._seen: "OrderedDict[Hashable, Tuple[Deque[int], Set[int]]]" = OrderedDict()
+        self.duplicates = 0
+
+    def is_duplicate(self, bot_key: Hashable, update_id: int) -> bool:
+        """Регистрирует update_id и возвращает True, если он уже встречался."""
+        entry = self._seen.get(bot_key)
+        if entry is None:
+            if len(self._seen) >= self.max_bots:
+                self._seen.popitem(last=False)
+            entry = (deque(), set())
+            self._seen[bot_key] = entry
+        else:
+            self._seen.move_to_end(bot_key)
+
+        ring, ids = entry
+        if update_id in ids:
+            self.duplicates += 1
+            return True
+
+        if len(ring) >= self.window:
+            ids.discard(ring.popleft())
+        ring.append(update_id)
+        ids.add(update_id)
+        return False
+
+    def forget(self, bot_key: Hashable, update_id: int) -> None:
+        """Снимает отметку, чтобы повторная доставка не была отброшена (например, после 503)."""
+        entry = self._seen.get(bot_key)
+        if entry is None:
+            return
+        ring, ids = entry
+        if update_id in ids:
+            # Убираем и из кольца: иначе при вытеснении старой копии id пропал бы из set,
+            # пока новая копия (после повторной доставки) еще в окне
+            ids.discard(update_id)
+            ring.remove(update_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"duplicates_dropped": self.duplicates, "bots_tracked": len(self._seen)}
+
+
+update_deduplicator = UpdateDeduplicator(
+    window=settings.UPDATE_DEDUP_WINDOW,
+    max_bots=settings.UPDATE_DEDUP_MAX_BOTS
+)
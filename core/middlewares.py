@@ -2,10 +2,7 @@ from typing import Any, Awaitable, Callable, Dict
 from datetime import datetime
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Message
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-from database.db import async_session
-from database.models import Agent, User
+from core.agent_cache import agent_config_cache
 
 # Эта Middleware создает сессию БД и передает её в хендлер как аргумент "session"
 class DbSessionMiddleware(BaseMiddleware):
@@ -34,40 +31,29 @@ class AgentContextMiddleware(BaseMiddleware):
         agent_id = data.get("agent_id")
         
         if agent_id:
-            session = data.get("session")
-            if session:
-                # 1. Используем joinedload, чтобы одним запросом достать и Агента, и его Владельца (User)
-                result = await session.execute(
-                    select(Agent).options(joinedload(Agent.owner)).where(Agent.id == agent_id)
-                )
-                agent = result.scalar_one_or_none()
-                
-                if agent:
-                    owner = agent.owner
-                    
-                    # 2. ПРОВЕРКА СТАТУСА ПОДПИСКИ
-                    # Если дата окончания подписки установлена и она меньше текущего времени (подписка истекла)
-                    if owner.subscription_end_date and owner.subscription_end_date < datetime.utcnow():
-                        
-                        # Если это обычное текстовое сообщение, отвечаем заглушкой
-                        if isinstance(event, Message):
-                            await event.answer(
-                                "⚠️ Извините, но этот бот временно недоступен.\n"
-                                "Владельцу бота необходимо проверить статус своей подписки."
-                            )
-                        
-                        # ВАЖНО: Прерываем выполнение!
-                        # Мы НЕ вызываем await handler(event, data), 
-                        # поэтому код не пойдет в handlers/agent.py и не потратит токены LLM.
-                        return
-                    
-                    # 3. Если с подпиской всё в порядке, собираем конфиг и пускаем запрос дальше
-                    data["agent_config"] = {
-                        "id": agent.id,
-                        "system_prompt": agent.system_prompt,
-                        "is_active": agent.is_active,
-                        "welcome_message": agent.welcome_message
-                    }
+            # 1. Конфиг агента и дата подписки владельца берутся из общего кэша (без запроса в БД)
+            agent_config = await agent_config_cache.get(agent_id)
+
+            if agent_config:
+                # 2. ПРОВЕРКА СТАТУСА ПОДПИСКИ
+                # Если дата окончания подписки установлена и она меньше текущего времени (подписка истекла)
+                subscription_end_date = agent_config["subscription_end_date"]
+                if subscription_end_date and subscription_end_date < datetime.utcnow():
+
+                    # Если это обычное текстовое сообщение, отвечаем заглушкой
+                    if isinstance(event, Message):
+                        await event.answer(
+                            "⚠️ Извините, но этот бот временно недоступен.\n"
+                            "Владельцу бота необходимо проверить статус своей подписки."
+                        )
+
+                    # ВАЖНО: Прерываем выполнение!
+                    # Мы НЕ вызываем await handler(event, data), 
+                    # поэтому код не пойдет в handlers/agent.py и не потратит токены LLM.
+                    return
+
+                # 3. Если с подпиской всё в порядке, пускаем запрос дальше
+                data["agent_config"] = agent_config
         
         # Передаем управление в следующий хендлер (handlers/agent.py)
         return await handler(event, data)
\ No newline at end of file
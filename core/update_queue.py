@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from core.config import settings
+
+# (agent_id, chat_id): апдейты одного чата обрабатываются строго по очереди
+ChatKey = Tuple[int, int]
+UpdateHandler = Callable[[int, Bot, Update], Awaitable[Any]]
+
+
+def get_update_chat_id(update: Update) -> int:
+    """Определяет чат апдейта для сохранения порядка сообщений одного пользователя."""
+    for event in (update.message, update.edited_message):
+        if event:
+            return event.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    # Для прочих типов апдейтов порядок не важен
+    return -update.update_id
+
+
+class AgentUpdateQueue:
+    """
+    Ограниченная in-memory очередь апдейтов агентов для режима быстрого ответа вебхука.
+
+    Эндпоинт кладет апдейт в очередь и сразу отвечает Telegram 200, а пул воркеров
+    разбирает очередь. Одновременно обрабатывается не более одного апдейта на чат
+    (порядок сообщений сохраняется) и не более agent_concurrency апдейтов на агента.
+    Чаты агента, упершегося в лимит, «паркуются» и не занимают воркеры.
+    """
+
+    def __init__(self, workers: int, max_size: int, agent_concurrency: int):
+        self.workers = workers
+        self.max_size = max_size
+        self.agent_concurrency = agent_concurrency
+
+        self._ready: "asyncio.Queue[ChatKey]" = asyncio.Queue()
+        self._pending: Dict[ChatKey, Deque[Tuple[Bot, Update, float]]] = defaultdict(deque)
+        self._scheduled: Set[ChatKey] = set()
+        self._parked: Dict[int, Deque[ChatKey]] = defaultdict(deque)
+        self._tasks: List[asyncio.Task] = []
+        self._handler: Optional[UpdateHandler] = None
+
+        # Метрики
+        self._size = 0
+        self._agent_queued: Dict[int, int] = defaultdict(int)
+        self._agent_inflight: Dict[int, int] = defaultdict(int)
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self, handler: UpdateHandler) -> None:
+        self._handler = handler
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Дает воркерам дообработать очередь, после чего останавливает их."""
+        deadline = time.monotonic() + timeout
+        while self._size and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, agent_id: int, bot: Bot, update: Update) -> bool:
+        """Ставит апдейт в очередь. False — очередь переполнена (backpressure)."""
+        if self._size >= self.max_size:
+            self.rejected += 1
+            return False
+
+        key = (agent_id, get_update_chat_id(update))
+        self._pending[key].append((bot, update, time.monotonic()))
+        self._size += 1
+        self._agent_queued[agent_id] += 1
+        self.enqueued += 1
+
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            agent_id = key[0]
+
+            if self._agent_inflight[agent_id] >= self.agent_concurrency:
+                # Агент уже занял свой лимит — чат подождет освобождения слота
+                self._parked[agent_id].append(key)
+                continue
+
+            bot, update, enqueued_at = self._pending[key].popleft()
+            self._size -= 1
+            self._agent_queued[agent_id] -= 1
+            self._agent_inflight[agent_id] += 1
+
+            wait = time.monotonic() - enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+            try:
+                await self._handler(agent_id, bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"❌ Ошибка обработки апдейта агента {agent_id}: {e}")
+            finally:
+                self._agent_inflight[agent_id] -= 1
+                self._release(key)
+
+    def _release(self, key: ChatKey) -> None:
+        agent_id = key[0]
+
+        if self._pending[key]:
+            self._ready.put_nowait(key)
+        else:
+            del self._pending[key]
+            self._scheduled.discard(key)
+
+        if self._parked[agent_id]:
+            self._ready.put_nowait(self._parked[agent_id].popleft())
+
+        if not self._agent_inflight[agent_id] and not self._agent_queued[agent_id]:
+            self._agent_inflight.pop(agent_id, None)
+            self._agent_queued.pop(agent_id, None)
+            self._parked.pop(agent_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.processed + self.failed
+        return {
+            "depth": self._size,
+            "max_size": self.max_size,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self._wait_total / started * 1000, 2) if started else 0,
+            "max_wait_ms": round(self._wait_max * 1000, 2),
+            "agents": {
+                agent_id: {
+                    "queued": self._agent_queued[agent_id],
+                    "inflight": self._agent_inflight[agent_id]
+                }
+                for agent_id in set(self._agent_queued) | set(self._agent_inflight)
+            }
+        }
+
+
+update_queue = AgentUpdateQueue(
+    workers=settings.UPDATE_QUEUE_WORKERS,
+    max_size=settings.UPDATE_QUEUE_MAX_SIZE,
+    agent_concurrency=settings.AGENT_MAX_CONCURRENCY
+)
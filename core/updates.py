@@ -0,0 +1,12 @@
+from aiogram import Bot
+from aiogram.types import Update
+
+
+def decode_update(raw_body: bytes, bot: Bot) -> Update:
+    """
+    Валидирует тело вебхука сразу в Update за один проход (pydantic-core парсит JSON сам).
+
+    Бот передается в контекст валидации: апдейт оказывается «примонтирован» к нему,
+    и feed_update не делает повторный model_dump/model_validate.
+    """
+    return Update.model_validate_json(raw_body, context={"bot": bot})
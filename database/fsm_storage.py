@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.models import FsmRecord
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram поверх общего async-движка SQLAlchemy.
+
+    Состояния (например, шаги CreateAgentSG) видны всем uvicorn-воркерам, поэтому
+    приложение можно запускать в несколько процессов без Redis. Запись — upsert,
+    чтение — запрос по первичному ключу. Кэша в процессе нет: апдейты одного
+    пользователя попадают в разные воркеры, и кэш отдавал бы устаревшее состояние.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker[AsyncSession]):
+        self.session_pool = session_pool
+
+    @staticmethod
+    def _build_key(key: StorageKey) -> str:
+        return ":".join(
+            str(part) for part in (
+                key.bot_id,
+                getattr(key, "business_connection_id", None) or "",
+                key.chat_id,
+                key.user_id,
+                key.thread_id or "",
+                key.destiny
+            )
+        )
+
+    async def _load(self, record_key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        async with self.session_pool() as session:
+            result = await session.execute(
+                select(FsmRecord.state, FsmRecord.data).where(FsmRecord.key == record_key)
+            )
+            row = result.one_or_none()
+        return (row.state, dict(row.data or {})) if row else (None, {})
+
+    async def _upsert(self, record_key: str, **values: Any) -> None:
+        values["updated_at"] = datetime.utcnow()
+        stmt = insert(FsmRecord).values(key=record_key, **values)
+        stmt = stmt.on_conflict_do_update(index_elements=[FsmRecord.key], set_=values)
+        async with self.session_pool() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record_key = self._build_key(key)
+        state_name = state.state if isinstance(state, State) else state
+        await self._upsert(record_key, state=state_name)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._build_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record_key = self._build_key(key)
+        data = dict(data)
+        await self._upsert(record_key, data=data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._build_key(key))
+        return data
+
+    async def close(self) -> None:
+        pass
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import BigInteger, ForeignKey, String, Text, DateTime, Boolean
+from sqlalchemy import BigInteger, ForeignKey, String, Text, DateTime, Boolean, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .db import Base
 
@@ -61,4 +61,79 @@ class EndUser(Base):
     telegram_id: Mapped[int] = mapped_column(BigInteger, index=True)
     agent_id: Mapped[int] = mapped_column(ForeignKey("agents.id"))
     
-    first_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    first_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class FsmRecord(Base):
+    """Состояние и данные FSM aiogram (общие для всех воркеров и узлов)."""
+    __tablename__ = "fsm_records"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IndexJob(Base):
+    """Задача индексации документа (очередь в Postgres, переживает перезапуски)."""
+    __tablename__ = "index_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    document_id: Mapped[int] = mapped_column(ForeignKey("agent_documents.id", ondelete="CASCADE"), index=True)
+    agent_id: Mapped[int] = mapped_column(index=True)
+    file_path: Mapped[str] = mapped_column(String(500))
+    # Узел, в чьем temp_uploads лежит file_path (settings.INDEX_NODE_ID): только он забирает задачу
+    node_id: Mapped[str] = mapped_column(String(255), index=True)
+    # Имя и Telegram File ID новой версии при замене документа: попадают в AgentDocument
+    # только после успешной индексации, до этого документ показывается под прежним именем
+    file_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    file_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+    status: Mapped[str] = mapped_column(String(20), default="queued", index=True) # queued, running, done, failed
+    attempts: Mapped[int] = mapped_column(default=0)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    # Не раньше этого времени (бэкофф между повторами)
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Последний heartbeat воркера; задача с протухшим locked_at считается брошенной
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+class AgentChunkQuota(Base):
+    """Учет чанков агента для лимитов тарифа (вместо подсчета в Qdrant)."""
+    __tablename__ = "agent_chunk_quotas"
+
+    agent_id: Mapped[int] = mapped_column(ForeignKey("agents.id", ondelete="CASCADE"), primary_key=True)
+    used: Mapped[int] = mapped_column(default=0)  # чанков в Qdrant
+    reserved: Mapped[int] = mapped_column(default=0)  # зарезервировано под документы в обработке
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DocumentChunkQuota(Base):
+    """Доля документа в учете чанков агента: проиндексировано и зарезервировано."""
+    __tablename__ = "document_chunk_quotas"
+
+    document_id: Mapped[int] = mapped_column(ForeignKey("agent_documents.id", ondelete="CASCADE"), primary_key=True)
+    agent_id: Mapped[int] = mapped_column(index=True)
+    used: Mapped[int] = mapped_column(default=0)
+    reserved: Mapped[int] = mapped_column(default=0)
+
+class DocumentIndexProgress(Base):
+    """Ход индексации документа: этап, сколько чанков готово и время этапов (для владельца и метрик)."""
+    __tablename__ = "document_index_progress"
+
+    document_id: Mapped[int] = mapped_column(ForeignKey("agent_documents.id", ondelete="CASCADE"), primary_key=True)
+    stage: Mapped[str] = mapped_column(String(20), default="queued", index=True) # queued, indexing, done, error
+    chunks_total: Mapped[int] = mapped_column(default=0)
+    chunks_done: Mapped[int] = mapped_column(default=0)
+
+    # Время этапов в секундах; embed и upsert идут конвейером и пересекаются по времени
+    download_seconds: Mapped[float | None] = mapped_column(nullable=True)
+    extract_seconds: Mapped[float | None] = mapped_column(nullable=True)
+    split_seconds: Mapped[float | None] = mapped_column(nullable=True)
+    embed_seconds: Mapped[float | None] = mapped_column(nullable=True)
+    upsert_seconds: Mapped[float | None] = mapped_column(nullable=True)
+
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, index=True)
@@ -1,6 +1,7 @@
 from aiogram import Router, types
 from services.search_service import search_knowledge_base
 from services.ai_service import get_answer
+from services.llm_scheduler import llm_scheduler
 
 agent_router = Router()
 
@@ -24,11 +25,13 @@ async def handle_agent_message(message: types.Message, agent_config: dict):
             await message.answer("Здравствуйте! Чем я могу вам помочь?")
         return # Важно: прерываем выполнение функции, чтобы не идти в LLM
 
-    # 2. Поиск по базе знаний (только по этому агенту!)
-    # Если это не старт, работаем в обычном режиме
-    context = await search_knowledge_base(query, agent_id=agent_id)
-    
-    # 3. Генерация ответа через LLM с динамическим промптом
-    answer = await get_answer(query, context, system_prompt)
+    # Поиск и LLM выполняются в справедливой очереди: слоты делятся между агентами по тарифу владельца
+    async with llm_scheduler.slot(agent_id, agent_config.get("subscription_type")):
+        # 2. Поиск по базе знаний (только по этому агенту!)
+        # Если это не старт, работаем в обычном режиме
+        context = await search_knowledge_base(query, agent_id=agent_id)
+        
+        # 3. Генерация ответа через LLM с динамическим промптом
+        answer = await get_answer(query, context, system_prompt)
     
     await message.answer(answer)
\ No newline at end of file
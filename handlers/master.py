@@ -1,14 +1,21 @@
 import os
+import time
 import asyncio
 from aiogram import Router, F, Bot, types
 from aiogram.filters import CommandStart
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, update
 
 from database.models import User, Agent, AgentDocument
 from core.crypto import encrypt_token
-from services.indexer import process_document
+from core.bot_pool import agent_bot_pool
+from core.agent_cache import agent_config_cache
+from services.chunk_quota import chunk_quota
+from services.index_jobs import index_job_queue
+from services.index_progress import index_progress
+from services.indexer import discard_upload
 from states.master import CreateAgentSG
 from keyboards.master_kb import get_main_menu
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -216,6 +223,7 @@ async def process_prompt(message: types.Message, state: FSMContext, session: Asy
     agent_id = data['agent_id']
     await session.execute(update(Agent).where(Agent.id == agent_id).values(system_prompt=message.text))
     await session.commit()
+    agent_config_cache.invalidate(agent_id)
     await message.answer("Отправь файлы (.pdf, .docx, .txt). Когда закончишь, нажми /start")
     await state.set_state(CreateAgentSG.waiting_docs)
 
@@ -229,26 +237,35 @@ async def handle_docs(message: types.Message, state: FSMContext, session: AsyncS
     # 1. Сначала скачиваем файл во временную папку для анализа
     os.makedirs("temp_uploads", exist_ok=True)
     file_path = f"temp_uploads/{file_id}_{file_name}"
+    download_started = time.monotonic()
     await bot.download(message.document, destination=file_path)
+    download_seconds = time.monotonic() - download_started
 
     # 2. Предварительная проверка лимитов (Этап 4)
-    from services.indexer import extract_text, text_splitter, get_current_chunks_count, CHUNK_LIMITS
+    from services.indexer import prepare_document, CHUNK_LIMITS
     
     # Получаем тариф пользователя
     result = await session.execute(select(User).join(Agent).where(Agent.id == agent_id))
     user = result.scalar_one_or_none()
     limit = CHUNK_LIMITS.get(user.subscription_type, 100)
 
-    # Извлекаем текст и считаем чанки
-    text = await extract_text(file_path)
-    chunks = text_splitter.split_text(text)
-    new_chunks_count = len(chunks)
-    
-    current_count = await get_current_chunks_count(agent_id)
+    # Разбираем файл один раз (в пуле процессов): чанки сохраняются для индексации
+    new_chunks_count, timings = await prepare_document(file_path)
+
+    # 3. Создаем запись в БД и атомарно резервируем чанки под нее в учете агента
+    new_doc = AgentDocument(
+        agent_id=agent_id, 
+        file_name=file_name, 
+        file_id=file_id, 
+        status="processing"
+    )
+    session.add(new_doc)
+    await session.flush()
 
-    if current_count + new_chunks_count > limit:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    reserved, current_count = await chunk_quota.reserve(session, agent_id, new_doc.id, new_chunks_count, limit)
+    if not reserved:
+        await session.rollback()
+        discard_upload(file_path)
         
         await message.answer(
             f"🚫 *Лимит превышен!*\n\n"
@@ -260,19 +277,12 @@ async def handle_docs(message: types.Message, state: FSMContext, session: AsyncS
             parse_mode="Markdown"
         )
         return
-
-    # 3. Если лимит не превышен — создаем запись в БД и запускаем обработку
-    new_doc = AgentDocument(
-        agent_id=agent_id, 
-        file_name=file_name, 
-        file_id=file_id, 
-        status="processing"
-    )
-    session.add(new_doc)
-    await session.commit()
     
-    # Запускаем фоновую индексацию (теперь она точно пройдет по лимитам)
-    asyncio.create_task(process_document(file_path, agent_id, new_doc.id))
+    # Ставим индексацию в очередь задач в той же транзакции, что документ и резерв
+    await index_progress.record_prepared(
+        session, new_doc.id, new_chunks_count, {**timings, "download": download_seconds}
+    )
+    await index_job_queue.enqueue(session, new_doc.id, agent_id, file_path)
     
     await message.answer(
         f"✅ Файл '_{escape_md(file_name)}_' принят и обрабатывается ({new_chunks_count} чанков).",
@@ -388,6 +398,8 @@ async def toggle_agent(callback: types.CallbackQuery, session: AsyncSession):
     new_status = not agent.is_active
     agent.is_active = new_status
     await session.commit()
+    agent_bot_pool.invalidate(agent_id)
+    agent_config_cache.invalidate(agent_id)
 
     try:
         from core.crypto import decrypt_token
@@ -448,6 +460,8 @@ async def delete_agent(callback: types.CallbackQuery, session: AsyncSession):
         # 2. Удаляем из БД (каскадно удалятся и документы, если настроено в моделях)
         await session.delete(agent)
         await session.commit()
+        agent_bot_pool.invalidate(agent_id)
+        agent_config_cache.invalidate(agent_id)
         
         # Здесь также можно добавить вызов функции удаления векторов из Qdrant по agent_id
         
@@ -478,6 +492,8 @@ async def delete_agent(callback: types.CallbackQuery, session: AsyncSession):
             # Благодаря cascade="all, delete-orphan", документы удалятся сами!
             await session.delete(agent)
             await session.commit()
+            agent_bot_pool.invalidate(agent_id)
+            agent_config_cache.invalidate(agent_id)
             
             await callback.answer("Агент и все его данные успешно удалены.", show_alert=True)
             # Возвращаемся к списку агентов (импортируйте функцию show_my_agents если нужно)
@@ -539,6 +555,7 @@ async def process_ai_improve_prompt(callback: types.CallbackQuery, state: FSMCon
         update(Agent).where(Agent.id == agent_id).values(system_prompt=new_prompt)
     )
     await session.commit()
+    agent_config_cache.invalidate(agent_id)
     
     # Сбрасываем состояние FSM, так как редактирование завершено
     await state.clear()
@@ -579,6 +596,7 @@ async def process_new_prompt(message: types.Message, state: FSMContext, session:
         update(Agent).where(Agent.id == agent_id).values(system_prompt=message.text)
     )
     await session.commit()
+    agent_config_cache.invalidate(agent_id)
     
     await state.clear()
     
@@ -607,6 +625,10 @@ async def show_knowledge_base(callback: types.CallbackQuery, session: AsyncSessi
     )
     docs = docs_res.scalars().all()
 
+    # Ход индексации документов в обработке (этап и сколько чанков готово)
+    processing = [doc for doc in docs if doc.status == "processing"]
+    progress = await index_progress.for_documents(session, [doc.id for doc in processing])
+
     builder = InlineKeyboardBuilder()
 
     if docs:
@@ -617,26 +639,66 @@ async def show_knowledge_base(callback: types.CallbackQuery, session: AsyncSessi
             status_emoji = "⏳" if doc.status == "processing" else "✅" if doc.status == "ready" else "❌"
             
             builder.button(
-                text=f"🗑 {status_emoji} {short_name}",
-                callback_data=f"del_doc_conf_{doc.id}"
+                text=f"📄 {status_emoji} {short_name}",
+                callback_data=f"doc_menu_{doc.id}"
             )
         builder.adjust(1) # По одной кнопке в ряд
     
     # Кнопки навигации
     # builder.row(types.InlineKeyboardButton(text="➕ Добавить файл", callback_data=f"add_doc_{agent_id}")) # Задел на будущее
+    if processing:
+        builder.row(types.InlineKeyboardButton(text="🔄 Обновить прогресс", callback_data=f"edit_kb_{agent_id}"))
     builder.row(types.InlineKeyboardButton(text="➕ Добавить файл", callback_data=f"add_doc_{agent_id}"))
     builder.row(types.InlineKeyboardButton(text="⬅️ Назад к агенту", callback_data=f"agent_info_{agent_id}"))
 
     text = (
         "📚 *Управление базой знаний*\n\n"
-        "Нажмите на файл, который хотите удалить.\n\n"
+        "Нажмите на файл, чтобы заменить его новой версией или удалить.\n\n"
         "Легенда:\n"
         "✅ — Успешно загружен в ИИ\n"
         "⏳ — В процессе обработки\n"
         "❌ — Ошибка чтения файла"
     ) if docs else "📚 *Управление базой знаний*\n\nВ базе данных этого агента пока нет файлов."
 
-    await callback.message.edit_text(text, reply_markup=builder.as_markup(), parse_mode="Markdown")
+    if processing:
+        text += "\n\n*Обработка:*\n" + "\n".join(
+            f"⏳ _{escape_md(doc.file_name)}_ — {index_progress.describe(progress.get(doc.id))}"
+            for doc in processing
+        )
+
+    try:
+        await callback.message.edit_text(text, reply_markup=builder.as_markup(), parse_mode="Markdown")
+    except TelegramBadRequest as e:
+        # Повторное «Обновить», пока прогресс не изменился
+        if "message is not modified" not in str(e):
+            raise
+
+
+# --- МЕНЮ ДОКУМЕНТА ---
+
+@master_router.callback_query(F.data.startswith("doc_menu_"))
+async def show_document_menu(callback: types.CallbackQuery, session: AsyncSession):
+    doc_id = int(callback.data.split("_")[2])
+
+    doc = await session.get(AgentDocument, doc_id)
+    if not doc:
+        return await callback.answer("Ошибка: документ не найден.", show_alert=True)
+
+    status_text = "⏳ В обработке" if doc.status == "processing" else "✅ Загружен" if doc.status == "ready" else "❌ Ошибка"
+    text = (
+        f"📄 *{escape_md(doc.file_name)}*\n\n"
+        f"Статус: {status_text}\n\n"
+        f"При замене новой версией заново обрабатываются только изменившиеся фрагменты, "
+        f"а старая версия остается доступной боту до окончания обработки."
+    )
+
+    kb = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔄 Заменить новой версией", callback_data=f"repl_doc_{doc.id}")],
+        [types.InlineKeyboardButton(text="🗑 Удалить", callback_data=f"del_doc_conf_{doc.id}")],
+        [types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"edit_kb_{doc.agent_id}")]
+    ])
+
+    await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
 
 
 # --- ПОДТВЕРЖДЕНИЕ УДАЛЕНИЯ ДОКУМЕНТА ---
@@ -678,7 +740,8 @@ async def force_delete_document(callback: types.CallbackQuery, session: AsyncSes
         # 1. Удаляем векторы из векторной БД Qdrant
         await delete_document_vectors(doc_id)
 
-        # 2. Удаляем запись из Postgres
+        # 2. Удаляем запись из Postgres вместе с ее долей в учете чанков
+        await chunk_quota.forget_document(session, doc_id)
         await session.delete(doc)
         await session.commit()
 
@@ -695,6 +758,114 @@ async def force_delete_document(callback: types.CallbackQuery, session: AsyncSes
     )
     await show_knowledge_base(fake_callback, session)
 
+# --- ЗАМЕНА ДОКУМЕНТА НОВОЙ ВЕРСИЕЙ (ЗАПРОС) ---
+
+@master_router.callback_query(F.data.startswith("repl_doc_"))
+async def prompt_replace_document(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    doc_id = int(callback.data.split("_")[2])
+
+    doc = await session.get(AgentDocument, doc_id)
+    if not doc:
+        return await callback.answer("Ошибка: документ не найден.", show_alert=True)
+    if doc.status == "processing":
+        return await callback.answer("⏳ Документ еще обрабатывается, дождитесь окончания.", show_alert=True)
+
+    await state.update_data(edit_agent_id=doc.agent_id, replace_doc_id=doc.id)
+    await state.set_state(CreateAgentSG.replacing_doc)
+
+    kb = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="❌ Отмена", callback_data=f"doc_menu_{doc.id}")]
+    ])
+
+    await callback.message.edit_text(
+        f"🔄 *Замена файла* `{escape_md(doc.file_name)}`\n\n"
+        "Отправьте новую версию документа (PDF, TXT, DOCX).",
+        reply_markup=kb,
+        parse_mode="Markdown"
+    )
+
+# --- ПРИЕМ НОВОЙ ВЕРСИИ ДОКУМЕНТА ---
+
+@master_router.message(CreateAgentSG.replacing_doc, F.document)
+async def process_replace_document(message: types.Message, state: FSMContext, session: AsyncSession, bot: Bot):
+    data = await state.get_data()
+    agent_id = data.get('edit_agent_id')
+    doc_id = data.get('replace_doc_id')
+
+    doc = await session.get(AgentDocument, doc_id) if doc_id else None
+    if not doc or doc.agent_id != agent_id:
+        await message.answer("❌ Ошибка: заменяемый документ не найден. Начните сначала.")
+        await state.clear()
+        return
+
+    file_name = message.document.file_name
+    file_id = message.document.file_id
+
+    msg = await message.answer(f"⏳ Проверяю лимиты и сравниваю `{file_name}` с текущей версией...")
+
+    try:
+        os.makedirs("temp_uploads", exist_ok=True)
+        file_path = f"temp_uploads/{file_id}_{file_name}"
+        download_started = time.monotonic()
+        await bot.download(message.document, destination=file_path)
+        download_seconds = time.monotonic() - download_started
+
+        from services.indexer import prepare_document, CHUNK_LIMITS
+
+        result = await session.execute(
+            select(User).join(Agent).where(Agent.id == agent_id)
+        )
+        user = result.scalar_one_or_none()
+
+        current_plan = user.subscription_type if user else "Free"
+        limit = CHUNK_LIMITS.get(current_plan, 100)
+
+        new_chunks_count, timings = await prepare_document(file_path)
+
+        # Чанки старой версии освобождаются при замене, поэтому в лимит не входят
+        reserved, current_count = await chunk_quota.reserve(session, agent_id, doc.id, new_chunks_count, limit)
+        if not reserved:
+            await session.rollback()
+            discard_upload(file_path)
+
+            await msg.edit_text(
+                f"🚫 *Лимит базы знаний превышен!*\n\n"
+                f"Ваш тариф: *{current_plan}* (макс. {limit} чанков).\n"
+                f"Уже использовано: {current_count} (без текущей версии файла).\n"
+                f"Новая версия содержит: {new_chunks_count}.\n\n"
+                f"Удалите старые документы или повысьте тариф в меню.",
+                parse_mode="Markdown"
+            )
+            return
+
+        # Запись документа та же: индексация сравнит чанки с уже загруженными.
+        # Новые имя и file_id запишутся в документ только после успешной индексации
+        doc.status = "processing"
+        await session.flush()
+
+        await index_progress.record_prepared(
+            session, doc.id, new_chunks_count, {**timings, "download": download_seconds}
+        )
+        await index_job_queue.enqueue(
+            session, doc.id, agent_id, file_path, file_name=file_name, file_id=file_id
+        )
+        await msg.edit_text(f"✅ Новая версия `{file_name}` принята и обрабатывается ({new_chunks_count} чанков).")
+
+    except Exception as e:
+        print(f"❌ Ошибка в process_replace_document: {e}")
+        await msg.edit_text(f"❌ Ошибка при обработке файла: {e}")
+        if 'file_path' in locals():
+            discard_upload(file_path)
+
+    await state.clear()
+
+    await asyncio.sleep(2)
+    fake_callback = types.CallbackQuery(
+        id="0", from_user=message.from_user, chat_instance="0",
+        message=message, data=f"edit_kb_{agent_id}"
+    )
+    await show_knowledge_base(fake_callback, session)
+
 # --- ДОБАВЛЕНИЕ НОВОГО ДОКУМЕНТА (ЗАПРОС) ---
 
 @master_router.callback_query(F.data.startswith("add_doc_"))
@@ -740,10 +911,12 @@ async def process_extra_document(message: types.Message, state: FSMContext, sess
         # 1. Скачиваем файл для предварительного анализа чанков
         os.makedirs("temp_uploads", exist_ok=True)
         file_path = f"temp_uploads/{file_id}_{file_name}"
+        download_started = time.monotonic()
         await bot.download(message.document, destination=file_path)
+        download_seconds = time.monotonic() - download_started
 
         # 2. Импортируем инструменты лимитов из индексера
-        from services.indexer import extract_text, text_splitter, get_current_chunks_count, CHUNK_LIMITS, process_document
+        from services.indexer import prepare_document, CHUNK_LIMITS
         
         # 3. Получаем тариф пользователя (через владельца агента)
         from database.models import User, Agent
@@ -755,18 +928,23 @@ async def process_extra_document(message: types.Message, state: FSMContext, sess
         current_plan = user.subscription_type if user else "Free"
         limit = CHUNK_LIMITS.get(current_plan, 100)
 
-        # 4. Считаем чанки в новом файле
-        text = await extract_text(file_path)
-        chunks = text_splitter.split_text(text)
-        new_chunks_count = len(chunks)
-        
-        # Считаем текущее кол-во чанков в Qdrant
-        current_count = await get_current_chunks_count(agent_id)
+        # 4. Разбираем новый файл один раз (в пуле процессов): чанки сохраняются для индексации
+        new_chunks_count, timings = await prepare_document(file_path)
 
-        # 5. ПРОВЕРКА: Проходит ли файл в лимит?
-        if current_count + new_chunks_count > limit:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        # 5. ПРОВЕРКА: создаем запись и атомарно резервируем под нее чанки в учете агента
+        new_doc = AgentDocument(
+            agent_id=agent_id, 
+            file_name=file_name, 
+            file_id=file_id, 
+            status="processing"
+        )
+        session.add(new_doc)
+        await session.flush()
+
+        reserved, current_count = await chunk_quota.reserve(session, agent_id, new_doc.id, new_chunks_count, limit)
+        if not reserved:
+            await session.rollback()
+            discard_upload(file_path)
             
             await msg.edit_text(
                 f"🚫 *Лимит базы знаний превышен!*\n\n"
@@ -778,24 +956,18 @@ async def process_extra_document(message: types.Message, state: FSMContext, sess
             )
             return
 
-        # 6. Если всё хорошо — фиксируем в Postgres и запускаем фон
-        new_doc = AgentDocument(
-            agent_id=agent_id, 
-            file_name=file_name, 
-            file_id=file_id, 
-            status="processing"
+        # 6. Если всё хорошо — фиксируем в Postgres вместе с резервом и задачей индексации
+        await index_progress.record_prepared(
+            session, new_doc.id, new_chunks_count, {**timings, "download": download_seconds}
         )
-        session.add(new_doc)
-        await session.commit()
-
-        asyncio.create_task(process_document(file_path, agent_id, new_doc.id))
+        await index_job_queue.enqueue(session, new_doc.id, agent_id, file_path)
         await msg.edit_text(f"✅ Файл `{file_name}` принят и обрабатывается ({new_chunks_count} чанков).")
 
     except Exception as e:
         print(f"❌ Ошибка в process_extra_document: {e}")
         await msg.edit_text(f"❌ Ошибка при обработке файла: {e}")
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+        if 'file_path' in locals():
+            discard_upload(file_path)
 
     # 7. Возврат в меню базы знаний (через небольшую паузу, чтобы успели прочитать)
     await asyncio.sleep(2)
@@ -825,6 +997,7 @@ async def process_welcome_message(message: types.Message, state: FSMContext, ses
         update(Agent).where(Agent.id == agent_id).values(welcome_message=message.text)
     )
     await session.commit()
+    agent_config_cache.invalidate(agent_id)
     await state.clear()
     await message.answer("✅ Приветствие сохранено!")
 
@@ -851,6 +1024,7 @@ async def generate_welcome_callback(callback: types.CallbackQuery, state: FSMCon
         update(Agent).where(Agent.id == agent_id).values(welcome_message=generated_text)
     )
     await session.commit()
+    agent_config_cache.invalidate(agent_id)
     
     # 4. Очищаем состояние (пользователю больше не нужно вводить текст вручную)
     await state.clear()
@@ -934,6 +1108,7 @@ async def process_set_plan(callback: types.CallbackQuery, session: AsyncSession)
         )
     )
     await session.commit()
+    agent_config_cache.invalidate_owner(callback.from_user.id)
     
     await callback.answer(f"✅ Тариф {plan_name} успешно активирован на 30 дней!", show_alert=True)
     
@@ -1,44 +1,52 @@
-import os
+import asyncio
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Update
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
 # Ваши импорты
-from core.crypto import decrypt_token
+from core.agent_cache import agent_config_cache
+from core.bot_pool import agent_bot_pool
+from core.dedup import update_deduplicator
+from core.update_queue import update_queue
+from core.updates import decode_update
 from core.middlewares import AgentContextMiddleware, DbSessionMiddleware
 from handlers.agent import agent_router 
 from handlers.master import master_router 
+from services.llm_scheduler import llm_scheduler
+from services.embeddings import embedding_models
+from services.webhooks import webhook_reconciler
+from services.index_executor import embedding_cache, shutdown_index_executor
+from services.qdrant_writer import upsert_stats
+from services.index_jobs import index_job_queue
+from services.index_progress import index_progress
+from services.search_service import query_embedding_cache
 from database.db import async_session, engine, Base 
-from database.models import Agent
-from core.config import settings
-from qdrant_client import QdrantClient
+from database.fsm_storage import PostgresStorage
+from core.config import settings, q_client
 from qdrant_client.http import models
 
-# --- ГЕНЕРАТОР СЕССИЙ (Dependency Injection) ---
-async def get_session():
-    async with async_session() as session:
-        yield session
-
 # --- ЖИЗНЕННЫЙ ЦИКЛ ПРИЛОЖЕНИЯ ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # STARTUP
+    # Модели эмбеддингов грузятся в фоне: порт открывается сразу, готовность видна в /ready
+    warmup_task = None
+    if settings.EMBEDDINGS_WARMUP:
+        warmup_task = asyncio.create_task(embedding_models.warm_up_async())
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     print("✅ База данных инициализирована")
 
-    client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
     collection_name = "agent_documents"
     
     try:
-        collections = client.get_collections().collections
+        collections = (await q_client.get_collections()).collections
         if not any(c.name == collection_name for c in collections):
-            client.create_collection(
+            await q_client.create_collection(
                 collection_name=collection_name,
                 vectors_config=models.VectorParams(size=384, distance=models.Distance.COSINE),
                 sparse_vectors_config={
@@ -55,59 +63,112 @@ async def lifespan(app: FastAPI):
     await master_bot.set_webhook(url=webhook_url, drop_pending_updates=True)
     print(f"✅ Вебхук установлен")
 
+    # Вебхуки агентов сверяются в фоне и не задерживают готовность приложения
+    reconcile_task = None
+    if settings.WEBHOOK_RECONCILE_ON_STARTUP:
+        reconcile_task = asyncio.create_task(webhook_reconciler.run())
+
+    if settings.WEBHOOK_FAST_ACK:
+        update_queue.start(process_agent_update)
+        print(f"✅ Очередь апдейтов запущена ({update_queue.workers} воркеров)")
+
+    # Индексация документов: восстановление после падения и воркеры очереди задач
+    await index_job_queue.start()
+
     yield # Работа приложения
 
     # SHUTDOWN
     print("🛑 Закрытие ресурсов...")
+    for task in (warmup_task, reconcile_task):
+        if task and not task.done():
+            task.cancel()
+    if settings.WEBHOOK_FAST_ACK:
+        await update_queue.stop()
+    await index_job_queue.stop()
     await master_dp.storage.close()
     await agent_dp.storage.close()
     await master_bot.session.close()
+    await agent_bot_pool.close()
+    await q_client.close()
+    shutdown_index_executor()
 
 # --- ИНИЦИАЛИЗАЦИЯ APP (с передачей lifespan) ---
 app = FastAPI(lifespan=lifespan)
 
 # --- НАСТРОЙКА AIOGRAM ---
 master_bot = Bot(token=settings.MASTER_BOT_TOKEN)
-master_dp = Dispatcher(storage=MemoryStorage())
+master_dp = Dispatcher(storage=PostgresStorage(async_session))
 master_dp.update.middleware(DbSessionMiddleware(async_session)) 
 master_dp.include_router(master_router)
 
-agent_dp = Dispatcher(storage=MemoryStorage())
+agent_dp = Dispatcher(storage=PostgresStorage(async_session))
 agent_dp.update.middleware(DbSessionMiddleware(async_session)) 
 agent_dp.message.middleware(AgentContextMiddleware())
 agent_dp.include_router(agent_router)
 
+async def process_agent_update(agent_id: int, bot: Bot, tg_update: Update):
+    await agent_dp.feed_update(bot, tg_update, agent_id=agent_id)
+
 # --- ЭНДПОИНТЫ ---
 
 @app.post("/webhook/master")
 async def handle_master_webhook(request: Request):
-    update_data = await request.json()
-    tg_update = Update(**update_data)
+    tg_update = decode_update(await request.body(), master_bot)
+    # Повторная доставка того же апдейта (Telegram ретраит медленные вебхуки)
+    if update_deduplicator.is_duplicate("master", tg_update.update_id):
+        return {"status": "duplicate"}
     await master_dp.feed_update(master_bot, tg_update)
     return {"status": "ok"}
 
 @app.post("/webhook/{bot_id}")
-async def handle_agent_webhook(
-    bot_id: int, 
-    request: Request, 
-    session: AsyncSession = Depends(get_session) # Внедрение сессии
-):
+async def handle_agent_webhook(bot_id: int, request: Request):
     try:
-        result = await session.execute(select(Agent).where(Agent.id == bot_id))
-        agent = result.scalar_one_or_none()
+        # Конфиг агента берется из кэша: горячий агент обслуживается без запросов в Postgres
+        agent_config = await agent_config_cache.get(bot_id)
         
-        if not agent or not agent.is_active:
+        if not agent_config or not agent_config["is_active"]:
             return {"status": "ignored"}
 
-        token = decrypt_token(agent.encrypted_token)
-        
-        # Используем контекстный менеджер бота для авто-закрытия сессии
-        async with Bot(token=token) as bot:
-            update_data = await request.json()
-            tg_update = Update(**update_data)
-            await agent_dp.feed_update(bot, tg_update, agent_id=agent.id, session=session)
-            
+        # Бот берется из пула: без расшифровки токена и нового TLS-соединения на каждый апдейт
+        bot = agent_bot_pool.get(agent_config["id"], agent_config["encrypted_token"])
+
+        tg_update = decode_update(await request.body(), bot)
+        if update_deduplicator.is_duplicate(agent_config["id"], tg_update.update_id):
+            return {"status": "duplicate"}
+
+        if settings.WEBHOOK_FAST_ACK:
+            # Отвечаем Telegram сразу, обработка идет в пуле воркеров.
+            # При переполнении очереди отдаем 503 — Telegram повторит доставку позже.
+            if not update_queue.submit(agent_config["id"], bot, tg_update):
+                update_deduplicator.forget(agent_config["id"], tg_update.update_id)
+                return JSONResponse({"status": "busy"}, status_code=503)
+            return {"status": "queued"}
+
+        await process_agent_update(agent_config["id"], bot, tg_update)
+
         return {"status": "ok"}
     except Exception as e:
         logging.error(f"❌ Ошибка в агенте {bot_id}: {e}")
-        return {"status": "error"}
\ No newline at end of file
+        return {"status": "error"}
+
+@app.get("/ready")
+async def ready():
+    readiness = {"embeddings": embedding_models.readiness()}
+    status_code = 200 if embedding_models.is_ready else 503
+    return JSONResponse(readiness, status_code=status_code)
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "update_queue": update_queue.stats(),
+        "dedup": update_deduplicator.stats(),
+        "bot_pool": agent_bot_pool.stats(),
+        "agent_cache": agent_config_cache.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "webhook_reconcile": webhook_reconciler.stats(),
+        "index_jobs": await index_job_queue.stats(),
+        "qdrant_upserts": upsert_stats.stats(),
+        "index_progress": await index_progress.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "embedding_cache": await asyncio.to_thread(embedding_cache.stats) if embedding_cache else {"enabled": False}
+    }
@@ -0,0 +1,172 @@
+from typing import Optional, Tuple
+
+from qdrant_client.http import models
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import q_client
+from database.db import async_session
+from database.models import AgentChunkQuota, AgentDocument, DocumentChunkQuota
+
+
+async def _count_in_qdrant(key: str, value: int) -> int:
+    result = await q_client.count(
+        collection_name="agent_documents",
+        count_filter=models.Filter(
+            must=[models.FieldCondition(key=key, match=models.MatchValue(value=value))]
+        )
+    )
+    return result.count
+
+
+class ChunkQuotaLedger:
+    """
+    Учет чанков агентов в Postgres для лимитов тарифа.
+
+    Проверка лимита — чтение одной строки по первичному ключу вместо count в Qdrant.
+    Протокол вокруг индексации:
+      reserve — при загрузке, в одной транзакции с документом и задачей индексации;
+      commit  — после успешной индексации (резерв превращается в фактическое число чанков);
+      release — при окончательной ошибке индексации;
+      forget_document — при удалении документа.
+    Строка агента блокируется (SELECT ... FOR UPDATE) на время изменения, поэтому
+    параллельные загрузки не могут вместе превысить лимит. При первом обращении
+    учет агента заполняется подсчетом в Qdrant.
+    """
+
+    async def _lock_agent(self, session: AsyncSession, agent_id: int) -> AgentChunkQuota:
+        quota = await self._select_agent(session, agent_id)
+        if quota is None:
+            await self._seed(session, agent_id)
+            quota = await self._select_agent(session, agent_id)
+        return quota
+
+    @staticmethod
+    async def _select_agent(session: AsyncSession, agent_id: int) -> Optional[AgentChunkQuota]:
+        result = await session.execute(
+            select(AgentChunkQuota)
+            .where(AgentChunkQuota.agent_id == agent_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def _lock_document(session: AsyncSession, document_id: int) -> Optional[DocumentChunkQuota]:
+        result = await session.execute(
+            select(DocumentChunkQuota)
+            .where(DocumentChunkQuota.document_id == document_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        return result.scalar_one_or_none()
+
+    async def _seed(self, session: AsyncSession, agent_id: int) -> None:
+        """Первичное заполнение учета агента и его документов по данным Qdrant."""
+        used = await _count_in_qdrant("agent_id", agent_id)
+        docs_res = await session.execute(select(AgentDocument.id).where(AgentDocument.agent_id == agent_id))
+        for document_id in docs_res.scalars().all():
+            await session.execute(
+                pg_insert(DocumentChunkQuota)
+                .values(
+                    document_id=document_id,
+                    agent_id=agent_id,
+                    used=await _count_in_qdrant("document_id", document_id),
+                    reserved=0
+                )
+                .on_conflict_do_nothing(index_elements=["document_id"])
+            )
+        # Параллельный запрос мог заполнить учет раньше — тогда его строка остается
+        await session.execute(
+            pg_insert(AgentChunkQuota)
+            .values(agent_id=agent_id, used=used, reserved=0)
+            .on_conflict_do_nothing(index_elements=["agent_id"])
+        )
+        print(f"📊 Учет чанков агента {agent_id} заполнен из Qdrant: {used}")
+
+    async def reserve(
+        self,
+        session: AsyncSession,
+        agent_id: int,
+        document_id: int,
+        chunks: int,
+        limit: int
+    ) -> Tuple[bool, int]:
+        """
+        Резервирует chunks чанков под документ, если агент укладывается в limit.
+
+        Текущая версия документа (при замене) в занятое не входит — она будет заменена.
+        Изменения не коммитятся: резерв фиксируется вместе с документом и задачей индексации.
+        Возвращает (успех, сколько чанков уже занято без учета этого документа).
+        """
+        quota = await self._lock_agent(session, agent_id)
+        doc = await self._lock_document(session, document_id)
+        doc_used = doc.used if doc else 0
+        doc_reserved = doc.reserved if doc else 0
+
+        in_use = quota.used + quota.reserved - doc_used - doc_reserved
+        if in_use + chunks > limit:
+            return False, in_use
+
+        quota.reserved += chunks - doc_reserved
+        if doc is None:
+            session.add(DocumentChunkQuota(document_id=document_id, agent_id=agent_id, used=0, reserved=chunks))
+        else:
+            doc.reserved = chunks
+        await session.flush()
+        return True, in_use
+
+    async def allowance(self, agent_id: int, document_id: int, limit: int) -> int:
+        """
+        Сколько чанков может занять документ при индексации: его резерв, а для задач,
+        поставленных без резерва, — остаток лимита.
+        """
+        async with async_session() as session:
+            quota = await self._lock_agent(session, agent_id)
+            doc = await self._lock_document(session, document_id)
+            await session.commit()
+        if doc and doc.reserved:
+            return doc.reserved
+        return limit - (quota.used + quota.reserved - (doc.used if doc else 0))
+
+    async def commit(self, agent_id: int, document_id: int, chunks: int) -> None:
+        """Фиксирует фактическое число чанков документа после индексации и снимает резерв."""
+        async with async_session() as session:
+            quota = await self._lock_agent(session, agent_id)
+            doc = await self._lock_document(session, document_id)
+            if doc is None:
+                session.add(DocumentChunkQuota(document_id=document_id, agent_id=agent_id, used=chunks, reserved=0))
+                quota.used += chunks
+            else:
+                quota.used = max(0, quota.used + chunks - doc.used)
+                quota.reserved = max(0, quota.reserved - doc.reserved)
+                doc.used = chunks
+                doc.reserved = 0
+            await session.commit()
+
+    async def release(self, document_id: int) -> None:
+        """Снимает резерв документа, индексация которого окончательно не удалась."""
+        async with async_session() as session:
+            doc = await session.get(DocumentChunkQuota, document_id)
+            if doc is None or not doc.reserved:
+                return
+            quota = await self._lock_agent(session, doc.agent_id)
+            doc = await self._lock_document(session, document_id)
+            quota.reserved = max(0, quota.reserved - doc.reserved)
+            doc.reserved = 0
+            await session.commit()
+
+    async def forget_document(self, session: AsyncSession, document_id: int) -> None:
+        """Убирает документ из учета; коммит — вместе с удалением самого документа."""
+        doc = await session.get(DocumentChunkQuota, document_id)
+        if doc is None:
+            return
+        quota = await self._lock_agent(session, doc.agent_id)
+        doc = await self._lock_document(session, document_id)
+        quota.used = max(0, quota.used - doc.used)
+        quota.reserved = max(0, quota.reserved - doc.reserved)
+        await session.delete(doc)
+
+
+chunk_quota = ChunkQuotaLedger()
@@ -0,0 +1,160 @@
+"""
+Нарезка текста на чанки без langchain.
+
+Границы чанков те же, что у RecursiveCharacterTextSplitter (keep_separator=True,
+strip_whitespace=True): разделители перебираются по порядку, разделитель остается
+в начале следующего куска, соседние куски склеиваются до chunk_size с перекрытием
+chunk_overlap. Отличие в том, что нарезка работает с позициями в исходной строке,
+а не с копиями подстрок: каждый чанк сразу получает смещения начала и конца,
+а текст вырезается один раз. Модуль не зависит от остального приложения.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+# Полуинтервал [start, end) в исходном тексте
+Span = Tuple[int, int]
+
+
+class TextChunker:
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: Sequence[str]):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if not 0 <= chunk_overlap <= chunk_size:
+            raise ValueError(f"chunk_overlap must be between 0 and chunk_size, got {chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators)
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_spans(self, text: str, separator: Optional[str] = None) -> List[Span]:
+        """
+        Смещения чанков в text: text[start:end] — текст чанка.
+        separator — разделитель верхнего уровня, если он уже выбран (см. split_prefix).
+        """
+        spans: List[Span] = []
+        self._split(text, 0, len(text), self.separators, spans, separator=separator)
+        return spans
+
+    def split_prefix(
+        self, text: str, separator: Optional[str] = None, force: bool = False
+    ) -> Tuple[List[Span], int, Optional[str]]:
+        """
+        Для потоковой нарезки: чанки начала text, которые не изменятся, что бы ни
+        дописали в конец, позиция, с которой text нужно резать дальше вместе
+        с продолжением, и выбранный разделитель верхнего уровня — его нужно
+        передавать в следующие вызовы. Результат совпадает с нарезкой всего текста.
+
+        Пока в text нет первого разделителя, неизвестно, каким разделителем будет
+        резаться весь текст, поэтому ничего не отдается; force — резать по лучшему
+        из найденных разделителей (ограничивает буфер для текстов без него).
+        """
+        spans: List[Span] = []
+        if separator is None:
+            if not force and (not self.separators[0] or text.find(self.separators[0]) == -1):
+                return spans, 0, None
+            separator = self._choose(text, 0, len(text), self.separators)[0]
+        restart = self._split(text, 0, len(text), self.separators, spans, final=False, separator=separator)
+        return spans, restart, separator
+
+    @staticmethod
+    def _choose(text: str, start: int, end: int, separators: List[str]) -> Tuple[str, List[str]]:
+        """Первый из разделителей, который есть в тексте, и разделители следующих уровней."""
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                return candidate, []
+            if text.find(candidate, start, end) != -1:
+                return candidate, separators[i + 1:]
+        return separators[-1], []
+
+    def _split(
+        self,
+        text: str,
+        start: int,
+        end: int,
+        separators: List[str],
+        out: List[Span],
+        final: bool = True,
+        separator: Optional[str] = None
+    ) -> int:
+        if separator is None:
+            separator, rest = self._choose(text, start, end, separators)
+        else:
+            rest = separators[separators.index(separator) + 1:] if separator else []
+
+        pieces = self._pieces(text, start, end, separator)
+        if not final:
+            # Последний кусок может продолжиться в следующих данных — его не трогаем
+            if len(pieces) < 2:
+                return start
+            held = pieces.pop()
+
+        good: List[Span] = []
+        for piece in pieces:
+            if piece[1] - piece[0] < self.chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                self._merge(text, good, out)
+                good = []
+            if rest:
+                self._split(text, piece[0], piece[1], rest, out)
+            else:
+                out.append(piece)
+
+        if not final:
+            return self._merge(text, good, out, final=False) if good else held[0]
+        if good:
+            self._merge(text, good, out)
+        return end
+
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> List[Span]:
+        """Куски между вхождениями разделителя; разделитель относится к следующему куску."""
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+        pieces: List[Span] = []
+        piece_start = start
+        found = text.find(separator, start, end)
+        while found != -1:
+            if found > piece_start:
+                pieces.append((piece_start, found))
+            piece_start = found
+            found = text.find(separator, found + len(separator), end)
+        if end > piece_start:
+            pieces.append((piece_start, end))
+        return pieces
+
+    def _merge(self, text: str, pieces: List[Span], out: List[Span], final: bool = True) -> int:
+        """
+        Склеивает куски в чанки. Без final последний чанк не отдается, а возвращается
+        начало его первого куска: нарезка с этой позиции с пустым состоянием дает
+        те же чанки, что и продолжение текущей (в состоянии лежат ровно эти куски).
+        """
+        # Куски идут подряд, поэтому склейка — это просто интервал от первого до последнего
+        first = 0
+        total = 0
+        for i, (start, end) in enumerate(pieces):
+            length = end - start
+            if total + length > self.chunk_size:
+                if i > first:
+                    self._emit(text, pieces[first][0], pieces[i - 1][1], out)
+                    while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                        total -= pieces[first][1] - pieces[first][0]
+                        first += 1
+            total += length
+        if not final:
+            return pieces[first][0]
+        if first < len(pieces):
+            self._emit(text, pieces[first][0], pieces[-1][1], out)
+        return pieces[-1][1]
+
+    @staticmethod
+    def _emit(text: str, start: int, end: int, out: List[Span]) -> None:
+        # Как strip(): пробельные символы по краям не входят в чанк, пустые чанки пропускаются
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            out.append((start, end))
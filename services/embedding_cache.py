@@ -0,0 +1,225 @@
+"""
+Персистентный кэш эмбеддингов по содержимому чанка.
+
+Ключ — sha256 текста чанка плюс имя модели, поэтому повторно загруженный файл
+или один и тот же FAQ у нескольких агентов не проходят через ONNX второй раз.
+Хранилище — SQLite в режиме WAL: его одновременно используют процессы пула
+индексации, а основной процесс читает из него метрики. Модуль не зависит
+от БД, Qdrant и настроек приложения.
+"""
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SparseVector = Tuple[List[int], List[float]]
+
+# Сколько самых старых записей удаляется за один шаг вытеснения
+EVICT_BATCH = 1000
+# После вытеснения кэш занимает не больше этой доли лимита (запас, чтобы не вытеснять на каждой вставке)
+EVICT_TARGET = 0.9
+# LRU-метка записи обновляется не чаще этого: чтение недавно использованных векторов обходится без записи
+TOUCH_INTERVAL = 60.0  # секунд
+# Счетчики попаданий копятся в процессе и пишутся с ближайшей записью или поиском, если с прошлого сброса прошло больше
+COUNTERS_FLUSH_INTERVAL = 5.0  # секунд
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    key BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, key)
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES
+    ('entries', 0), ('bytes', 0), ('hits', 0), ('misses', 0), ('evictions', 0);
+"""
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def encode_dense(vector: Sequence[float]) -> bytes:
+    # Модели отдают float32, поэтому хранение в float32 не теряет точности
+    return array("f", vector).tobytes()
+
+
+def decode_dense(blob: bytes) -> List[float]:
+    return array("f", blob).tolist()
+
+
+def encode_sparse(vector: SparseVector) -> bytes:
+    indices, values = vector
+    return struct.pack("<I", len(indices)) + array("i", indices).tobytes() + array("f", values).tobytes()
+
+
+def decode_sparse(blob: bytes) -> SparseVector:
+    (count,) = struct.unpack_from("<I", blob)
+    split = 4 + count * 4
+    return array("i", blob[4:split]).tolist(), array("f", blob[split:]).tolist()
+
+
+class EmbeddingCache:
+    """
+    Кэш векторов в SQLite с вытеснением давно не использованных записей по размеру.
+
+    Соединение открывается лениво и отдельно в каждом процессе (после spawn/fork
+    соединение родителя использовать нельзя). Счетчики попаданий и размера лежат
+    в той же базе, поэтому метрики общие для всех воркеров пула.
+
+    Поиск — обычное чтение в WAL без блокировки записи: блокировка берется только
+    для обновления устаревших LRU-меток (TOUCH_INTERVAL), сброса счетчиков и вставки.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        # stats() вызывается из потоков event loop основного процесса
+        self._stats_lock = threading.Lock()
+        # Попадания и промахи этого процесса, еще не записанные в counters
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._flushed_at = time.monotonic()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, model: str, keys: List[bytes]) -> Dict[bytes, bytes]:
+        """Возвращает найденные векторы {ключ: blob}; LRU-метки и счетчики обновляются при необходимости."""
+        if not keys:
+            return {}
+        conn = self._connection()
+        unique = list(dict.fromkeys(keys))
+        placeholders = ",".join("?" * len(unique))
+        # Без явной транзакции: чтение из снимка WAL, писатели не блокируются
+        rows = conn.execute(
+            f"SELECT key, vector, last_used FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+            (model, *unique)
+        ).fetchall()
+        found = {bytes(key): bytes(vector) for key, vector, _ in rows}
+        self._pending_hits += len(found)
+        self._pending_misses += len(unique) - len(found)
+
+        now = time.time()
+        stale = [bytes(key) for key, _, last_used in rows if last_used < now - TOUCH_INTERVAL]
+        if not stale and time.monotonic() - self._flushed_at < COUNTERS_FLUSH_INTERVAL:
+            return found
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if stale:
+                conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE model = ? AND key IN ({','.join('?' * len(stale))})",
+                    (now, model, *stale)
+                )
+            self._flush_counters(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return found
+
+    def put_many(self, model: str, items: Dict[bytes, bytes]) -> None:
+        if not items:
+            return
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            entries = 0
+            size = 0
+            for key, vector in items.items():
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (model, key, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (model, key, vector, len(vector), now)
+                )
+                if cursor.rowcount:
+                    entries += 1
+                    size += len(vector)
+            self._bump(conn, entries=entries, bytes=size)
+            self._flush_counters(conn)
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        target = int(self.max_bytes * EVICT_TARGET)
+        total = self._counter(conn, "bytes")
+        if total <= self.max_bytes:
+            return
+        while total > target:
+            rows = conn.execute(
+                "SELECT rowid, size FROM embeddings ORDER BY last_used LIMIT ?", (EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            freed = 0
+            for rowid, size in rows:
+                victims.append(rowid)
+                freed += size
+                if total - freed <= target:
+                    break
+            conn.execute(
+                f"DELETE FROM embeddings WHERE rowid IN ({','.join('?' * len(victims))})", victims
+            )
+            self._bump(conn, entries=-len(victims), bytes=-freed, evictions=len(victims))
+            total -= freed
+
+    def _flush_counters(self, conn: sqlite3.Connection) -> None:
+        """Записывает накопленные попадания и промахи (внутри транзакции записи)."""
+        self._bump(conn, hits=self._pending_hits, misses=self._pending_misses)
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._flushed_at = time.monotonic()
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, **deltas: int) -> None:
+        conn.executemany(
+            "UPDATE counters SET value = value + ? WHERE name = ?",
+            [(delta, name) for name, delta in deltas.items() if delta]
+        )
+
+    @staticmethod
+    def _counter(conn: sqlite3.Connection, name: str) -> int:
+        return conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self._connection().execute("SELECT name, value FROM counters").fetchall())
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "enabled": True,
+            "entries": counters["entries"],
+            "size_mb": round(counters["bytes"] / 1024 / 1024, 2),
+            "max_size_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+            "evictions": counters["evictions"]
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from fastembed import SparseTextEmbedding, TextEmbedding
+
+DENSE_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+SPARSE_MODEL_NAME = "prithivida/Splade_PP_en_v1"
+
+_FACTORIES = {
+    DENSE_MODEL_NAME: TextEmbedding,
+    SPARSE_MODEL_NAME: SparseTextEmbedding
+}
+
+
+class EmbeddingModelRegistry:
+    """
+    Единый реестр моделей эмбеддингов процесса.
+
+    Каждая модель загружается один раз — при первом обращении или при фоновом
+    прогреве из lifespan, — и разделяется индексатором и поиском. Пока модели
+    не загружены, приложение уже принимает запросы, а /ready отдает статус прогрева.
+    """
+
+    def __init__(self):
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.status = "cold"  # cold, loading, ready, error
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    def get(self, model_name: str) -> Any:
+        """Возвращает модель, загружая ее при первом обращении (блокирующий вызов)."""
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = _FACTORIES[model_name](model_name=model_name)
+            return self._models[model_name]
+
+    def dense(self) -> TextEmbedding:
+        return self.get(DENSE_MODEL_NAME)
+
+    def sparse(self) -> SparseTextEmbedding:
+        return self.get(SPARSE_MODEL_NAME)
+
+    def warm_up(self) -> None:
+        """Загружает все модели заранее (вызывается в фоновом потоке)."""
+        self.status = "loading"
+        started = time.perf_counter()
+        try:
+            for model_name in _FACTORIES:
+                self.get(model_name)
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+            print(f"❌ Ошибка загрузки моделей эмбеддингов: {e}")
+            return
+        self.load_seconds = round(time.perf_counter() - started, 2)
+        self.status = "ready"
+        print(f"✅ Модели эмбеддингов загружены за {self.load_seconds} с")
+
+    async def warm_up_async(self) -> None:
+        await asyncio.to_thread(self.warm_up)
+
+    @property
+    def is_ready(self) -> bool:
+        return all(name in self._models for name in _FACTORIES)
+
+    def readiness(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.is_ready else self.status,
+            "models": {name: name in self._models for name in _FACTORIES},
+            "load_seconds": self.load_seconds,
+            "error": self.error
+        }
+
+
+embedding_models = EmbeddingModelRegistry()
@@ -0,0 +1,95 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing.managers import SyncManager
+from typing import Any, Callable, Optional
+
+from core.config import settings
+from services.embedding_cache import EmbeddingCache
+from services.text_pipeline import init_worker
+
+_executor: Optional[ProcessPoolExecutor] = None
+_manager: Optional[SyncManager] = None
+
+# Тот же файл кэша, что и у воркеров пула; в основном процессе — только для метрик
+embedding_cache = (
+    EmbeddingCache(settings.EMBED_CACHE_PATH, settings.EMBED_CACHE_MAX_MB * 1024 * 1024)
+    if settings.EMBED_CACHE_PATH else None
+)
+
+
+def get_index_workers() -> int:
+    return settings.INDEX_WORKERS or os.cpu_count() or 1
+
+
+def get_index_executor() -> ProcessPoolExecutor:
+    """
+    Пул процессов для CPU-части индексации (pdfplumber, python-docx, нарезка, ONNX).
+
+    Event loop, обслуживающий вебхуки, при индексации только ждет результатов.
+    Используется spawn: fork процесса с запущенным event loop и потоками ONNX небезопасен.
+    Воркеры при старте загружают модели и открывают общий кэш эмбеддингов.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=get_index_workers(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(settings.EMBED_CACHE_PATH, settings.EMBED_CACHE_MAX_MB * 1024 * 1024)
+        )
+    return _executor
+
+
+def get_stream_manager() -> SyncManager:
+    """Менеджер разделяемых очередей для потоковой передачи пачек из процессов пула."""
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    return _manager
+
+
+def reset_index_executor(broken: ProcessPoolExecutor) -> None:
+    """
+    Выбрасывает сломанный пул (воркер упал, например, по OOM): ProcessPoolExecutor
+    после этого отклоняет все задачи, и следующий вызов get_index_executor создаст новый.
+    """
+    global _executor
+    # Пул мог уже пересоздать другой вызов — новый не трогаем
+    if _executor is broken:
+        _executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        print("♻️ Пул процессов индексации сломан и будет пересоздан")
+
+
+async def run_in_index_pool(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args, **kwargs)
+    executor = get_index_executor()
+    try:
+        future = loop.run_in_executor(executor, call)
+    except BrokenProcessPool:
+        # Пул сломался на другой задаче, эта до него не дошла — запускаем ее в новом пуле
+        reset_index_executor(executor)
+        executor = get_index_executor()
+        future = loop.run_in_executor(executor, call)
+    try:
+        return await future
+    except BrokenProcessPool:
+        # Воркер умер во время задачи: пул пересоздаем, а ошибку отдаем вызывающему —
+        # повтор той же задачи мог бы снова уронить воркер, это решает очередь задач
+        reset_index_executor(executor)
+        raise
+
+
+def shutdown_index_executor(wait: bool = False) -> None:
+    global _executor, _manager
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
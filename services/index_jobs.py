@@ -0,0 +1,374 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from database.db import async_session
+from database.models import AgentDocument, DocumentChunkQuota, IndexJob
+from services.chunk_quota import chunk_quota
+from services.index_executor import get_index_workers
+from services.index_progress import index_progress
+from services.indexer import PermanentIndexingError, discard_upload, process_document
+from services.text_pipeline import CHUNKS_ARTIFACT_SUFFIX
+
+UPLOAD_DIR = "temp_uploads"
+# Файлы моложе этого возраста не считаются брошенными: их может прямо сейчас проверять хендлер
+ORPHAN_FILE_GRACE = 3600  # секунд
+# Сколько последних задач учитывается в метриках задержки
+LATENCY_WINDOW = 500
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class IndexJobQueue:
+    """
+    Очередь задач индексации в Postgres вместо asyncio.create_task.
+
+    Задача создается в той же транзакции, что и AgentDocument, поэтому не теряется
+    при перезапуске. Загруженный файл и артефакт нарезки лежат в локальном temp_uploads,
+    поэтому задачу выполняет только узел, принявший загрузку (node_id); несколько
+    воркеров узла (и uvicorn-процессов с тем же INDEX_NODE_ID) забирают задачи через
+    SELECT ... FOR UPDATE SKIP LOCKED, держат lease heartbeat'ом и повторяют временные
+    ошибки с экспоненциальной задержкой. Задача, чей воркер умер, снова выдается
+    после истечения lease.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        max_attempts: int,
+        retry_delay: int,
+        lease: int,
+        poll_interval: float,
+        node_id: str
+    ):
+        self.node_id = node_id
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.reclaimed = 0
+        self._wait_times: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._run_times: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    async def enqueue(
+        self,
+        session: AsyncSession,
+        document_id: int,
+        agent_id: int,
+        file_path: str,
+        file_name: Optional[str] = None,
+        file_id: Optional[str] = None
+    ) -> None:
+        """
+        Ставит документ в очередь и коммитит сессию (вместе с самим AgentDocument).
+        file_name и file_id передаются при замене документа: они применяются после индексации.
+        """
+        session.add(IndexJob(
+            document_id=document_id, agent_id=agent_id, file_path=file_path, node_id=self.node_id,
+            file_name=file_name, file_id=file_id
+        ))
+        await session.commit()
+        self.notify()
+
+    def notify(self) -> None:
+        # Будим воркеры этого процесса, не дожидаясь очередного опроса
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        await self.recover()
+        workers = self.concurrency or get_index_workers()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+        print(f"✅ Очередь индексации запущена: воркеров {workers}")
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def recover(self) -> None:
+        """
+        Восстановление после падения: документы, застрявшие в 'processing' без живой задачи,
+        помечаются ошибкой (их резерв в учете чанков снимается), а файлы в temp_uploads без задачи (и их артефакты нарезки) удаляются.
+        Документ, у которого уже есть проиндексированная версия (оборвалась замена), снова 'ready'.
+        Задачи 'running' отдельно чинить не нужно: они снова выдаются по истечении lease.
+        """
+        async with async_session() as session:
+            active_jobs = select(IndexJob.document_id).where(IndexJob.status.in_(("queued", "running")))
+            indexed = select(DocumentChunkQuota.document_id).where(DocumentChunkQuota.used > 0)
+            stuck = (AgentDocument.status == "processing", AgentDocument.id.not_in(active_jobs))
+            result = await session.execute(
+                update(AgentDocument)
+                .where(*stuck, AgentDocument.id.in_(indexed))
+                .values(status="ready")
+                .returning(AgentDocument.id)
+            )
+            restored_ids = result.scalars().all()
+            result = await session.execute(
+                update(AgentDocument)
+                .where(*stuck)
+                .values(status="error")
+                .returning(AgentDocument.id)
+            )
+            failed_ids = result.scalars().all()
+            await session.commit()
+            if restored_ids:
+                print(f"⚠️ Оборванных замен документов (осталась прежняя версия): {len(restored_ids)}")
+            if failed_ids:
+                print(f"⚠️ Документов без задачи индексации помечено ошибкой: {len(failed_ids)}")
+            for document_id in [*restored_ids, *failed_ids]:
+                await chunk_quota.release(document_id)
+                await index_progress.fail(document_id)
+
+            paths_res = await session.execute(
+                select(IndexJob.file_path).where(IndexJob.status.in_(("queued", "running")))
+            )
+            active_paths = {os.path.normpath(path) for path in paths_res.scalars()}
+
+        if not os.path.isdir(UPLOAD_DIR):
+            return
+        removed = 0
+        now = time.time()
+        for name in os.listdir(UPLOAD_DIR):
+            path = os.path.normpath(os.path.join(UPLOAD_DIR, name))
+            try:
+                upload_path = path[:-len(CHUNKS_ARTIFACT_SUFFIX)] if path.endswith(CHUNKS_ARTIFACT_SUFFIX) else path
+                if upload_path in active_paths or now - os.path.getmtime(path) < ORPHAN_FILE_GRACE:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        if removed:
+            print(f"🧹 Удалено брошенных файлов из {UPLOAD_DIR}: {removed}")
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        async with async_session() as session:
+            result = await session.execute(
+                select(IndexJob)
+                .where(IndexJob.node_id == self.node_id)
+                .where(or_(
+                    (IndexJob.status == "queued") & (IndexJob.run_after <= now),
+                    (IndexJob.status == "running") & (IndexJob.locked_at < now - timedelta(seconds=self.lease))
+                ))
+                .order_by(IndexJob.run_after, IndexJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalar_one_or_none()
+            if job is None:
+                return None
+
+            if job.status == "running":
+                self.reclaimed += 1
+                print(f"♻️ Задача индексации {job.id} осталась без воркера, выдаем повторно")
+            job.status = "running"
+            job.attempts += 1
+            job.locked_at = now
+            if job.started_at is None:
+                job.started_at = now
+                self._wait_times.append((now - job.created_at).total_seconds())
+            claimed = {
+                "id": job.id,
+                "document_id": job.document_id,
+                "agent_id": job.agent_id,
+                "file_path": job.file_path,
+                "file_name": job.file_name,
+                "file_id": job.file_id,
+                "attempts": job.attempts,
+            }
+            await session.commit()
+            return claimed
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"⚠️ Очередь индексации: ошибка при получении задачи: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run(job)
+            except Exception as e:
+                # Статус не записался — задачу подберет повторная выдача по lease
+                print(f"⚠️ Очередь индексации: ошибка при завершении задачи {job['id']}: {e}")
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        if job["attempts"] > self.max_attempts:
+            # Воркер падал на этой задаче слишком много раз — не даем ей валить узлы дальше
+            await self._fail(job, "Превышено число попыток индексации")
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        started = time.monotonic()
+        try:
+            await process_document(
+                job["file_path"], job["agent_id"], job["document_id"], job["file_name"], job["file_id"]
+            )
+        except asyncio.CancelledError:
+            # Штатная остановка: возвращаем задачу в очередь, попытка не засчитывается
+            await self._release(job)
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка при индексации документа {job['document_id']} (попытка {job['attempts']}): {e}")
+            if isinstance(e, PermanentIndexingError) or job["attempts"] >= self.max_attempts:
+                await self._fail(job, str(e))
+            else:
+                await self._retry(job, str(e))
+        else:
+            await self._finish(job)
+        finally:
+            heartbeat.cancel()
+            self._run_times.append(time.monotonic() - started)
+
+    async def _heartbeat(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                async with async_session() as session:
+                    await session.execute(
+                        update(IndexJob).where(IndexJob.id == job_id).values(locked_at=datetime.utcnow())
+                    )
+                    await session.commit()
+            except Exception as e:
+                print(f"⚠️ Не удалось продлить задачу индексации {job_id}: {e}")
+
+    async def _finish(self, job: Dict[str, Any]) -> None:
+        self.completed += 1
+        async with async_session() as session:
+            await session.execute(
+                update(IndexJob)
+                .where(IndexJob.id == job["id"])
+                .values(status="done", finished_at=datetime.utcnow(), locked_at=None, last_error=None)
+            )
+            await session.commit()
+        discard_upload(job["file_path"])
+
+    async def _retry(self, job: Dict[str, Any], error: str) -> None:
+        self.retried += 1
+        delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+        async with async_session() as session:
+            await session.execute(
+                update(IndexJob)
+                .where(IndexJob.id == job["id"])
+                .values(
+                    status="queued",
+                    run_after=datetime.utcnow() + timedelta(seconds=delay),
+                    locked_at=None,
+                    last_error=error
+                )
+            )
+            await session.commit()
+        await index_progress.set_stage(job["document_id"], "queued")
+        print(f"🔁 Задача индексации {job['id']} будет повторена через {delay} с")
+
+    async def _release(self, job: Dict[str, Any]) -> None:
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(IndexJob)
+                    .where(IndexJob.id == job["id"])
+                    .values(status="queued", attempts=IndexJob.attempts - 1, locked_at=None)
+                )
+                await session.commit()
+            await index_progress.set_stage(job["document_id"], "queued")
+        except Exception as e:
+            print(f"⚠️ Не удалось вернуть задачу индексации {job['id']} в очередь: {e}")
+
+    async def _fail(self, job: Dict[str, Any], error: str) -> None:
+        self.failed += 1
+        async with async_session() as session:
+            await session.execute(
+                update(IndexJob)
+                .where(IndexJob.id == job["id"])
+                .values(status="failed", finished_at=datetime.utcnow(), locked_at=None, last_error=error)
+            )
+            # Неудачная замена: предыдущая версия документа осталась в Qdrant и по-прежнему ищется
+            indexed = await session.scalar(
+                select(DocumentChunkQuota.used).where(DocumentChunkQuota.document_id == job["document_id"])
+            )
+            await session.execute(
+                update(AgentDocument)
+                .where(AgentDocument.id == job["document_id"])
+                .values(status="ready" if indexed else "error")
+            )
+            await session.commit()
+        await chunk_quota.release(job["document_id"])
+        await index_progress.fail(job["document_id"])
+        discard_upload(job["file_path"])
+
+    async def stats(self) -> Dict[str, Any]:
+        depth: Dict[str, int] = {}
+        oldest_queued = None
+        try:
+            async with async_session() as session:
+                rows = await session.execute(
+                    select(IndexJob.status, func.count(IndexJob.id))
+                    .where(IndexJob.status.in_(("queued", "running")))
+                    .group_by(IndexJob.status)
+                )
+                depth = {status: count for status, count in rows.all()}
+                oldest = await session.execute(
+                    select(func.min(IndexJob.created_at)).where(IndexJob.status == "queued")
+                )
+                oldest_at = oldest.scalar()
+                if oldest_at is not None:
+                    oldest_queued = round((datetime.utcnow() - oldest_at).total_seconds(), 2)
+        except Exception as e:
+            print(f"⚠️ Не удалось получить глубину очереди индексации: {e}")
+
+        wait_times = list(self._wait_times)
+        run_times = list(self._run_times)
+        return {
+            "workers": len(self._workers),
+            "queued": depth.get("queued", 0),
+            "running": depth.get("running", 0),
+            "oldest_queued_seconds": oldest_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "reclaimed": self.reclaimed,
+            "wait_seconds_p50": _percentile(wait_times, 0.5),
+            "wait_seconds_p95": _percentile(wait_times, 0.95),
+            "run_seconds_p50": _percentile(run_times, 0.5),
+            "run_seconds_p95": _percentile(run_times, 0.95),
+        }
+
+
+index_job_queue = IndexJobQueue(
+    concurrency=settings.INDEX_JOB_CONCURRENCY,
+    max_attempts=settings.INDEX_JOB_MAX_ATTEMPTS,
+    retry_delay=settings.INDEX_JOB_RETRY_DELAY,
+    lease=settings.INDEX_JOB_LEASE,
+    poll_interval=settings.INDEX_JOB_POLL_INTERVAL,
+    node_id=settings.INDEX_NODE_ID
+)
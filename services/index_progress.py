@@ -0,0 +1,189 @@
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import async_session
+from database.models import DocumentIndexProgress
+
+STAGES = ("download", "extract", "split", "embed", "upsert")
+# Не чаще этого пишем в БД промежуточный прогресс одного документа
+PROGRESS_UPDATE_INTERVAL = 2.0  # секунд
+# Сколько последних документов учитывается в перцентилях этапов
+TIMINGS_WINDOW = 500
+# За какой период берутся средние по этапам из БД (по всем узлам)
+METRICS_PERIOD = timedelta(hours=24)
+
+STAGE_LABELS = {
+    "queued": "в очереди",
+    "indexing": "индексация",
+    "done": "готово",
+    "error": "ошибка",
+}
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class IndexProgressTracker:
+    """
+    Ход индексации документов в таблице document_index_progress.
+
+    Загрузка файла, извлечение и нарезка выполняются в хендлере при проверке лимитов
+    (record_prepared), эмбеддинги и upsert — в process_document (start, advance, finish).
+    Промежуточный прогресс пишется не чаще PROGRESS_UPDATE_INTERVAL, поэтому
+    конвейер индексации не упирается в Postgres. Время этапов завершенных документов
+    попадает в /metrics: перцентили по этому процессу и средние из БД по всем узлам.
+    """
+
+    def __init__(self, update_interval: float = PROGRESS_UPDATE_INTERVAL):
+        self.update_interval = update_interval
+        self._last_write: Dict[int, float] = {}
+        self._timings: Dict[str, Deque[float]] = {stage: deque(maxlen=TIMINGS_WINDOW) for stage in STAGES}
+
+    async def record_prepared(
+        self,
+        session: AsyncSession,
+        document_id: int,
+        chunks_total: int,
+        timings: Dict[str, float]
+    ) -> None:
+        """Этапы проверки лимитов при загрузке; коммит — вместе с документом и задачей индексации."""
+        values = {
+            "stage": "queued",
+            "chunks_total": chunks_total,
+            "chunks_done": 0,
+            "download_seconds": timings.get("download"),
+            "extract_seconds": timings.get("extract"),
+            "split_seconds": timings.get("split"),
+            "embed_seconds": None,
+            "upsert_seconds": None,
+            "started_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+            "finished_at": None,
+        }
+        # При замене документа строка прошлой версии перезаписывается
+        await session.execute(
+            pg_insert(DocumentIndexProgress)
+            .values(document_id=document_id, **values)
+            .on_conflict_do_update(index_elements=["document_id"], set_=values)
+        )
+
+    async def _write(self, document_id: int, **values: Any) -> None:
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(DocumentIndexProgress)
+                    .where(DocumentIndexProgress.document_id == document_id)
+                    .values(updated_at=datetime.utcnow(), **values)
+                )
+                await session.commit()
+        except Exception as e:
+            # Прогресс — вспомогательные данные и не должен ронять индексацию
+            print(f"⚠️ Не удалось записать прогресс индексации документа {document_id}: {e}")
+
+    async def set_stage(self, document_id: int, stage: str) -> None:
+        await self._write(document_id, stage=stage)
+
+    async def start(self, document_id: int) -> None:
+        self._last_write[document_id] = time.monotonic()
+        await self._write(document_id, stage="indexing", chunks_done=0, embed_seconds=0.0, upsert_seconds=0.0)
+
+    async def advance(self, document_id: int, chunks_done: int, embed_seconds: float, upsert_seconds: float) -> None:
+        now = time.monotonic()
+        if now - self._last_write.get(document_id, 0) < self.update_interval:
+            return
+        self._last_write[document_id] = now
+        await self._write(
+            document_id, chunks_done=chunks_done, embed_seconds=embed_seconds, upsert_seconds=upsert_seconds
+        )
+
+    async def finish(self, document_id: int, chunks_done: int, embed_seconds: float, upsert_seconds: float) -> None:
+        self._last_write.pop(document_id, None)
+        await self._write(
+            document_id,
+            stage="done",
+            chunks_total=chunks_done,
+            chunks_done=chunks_done,
+            embed_seconds=embed_seconds,
+            upsert_seconds=upsert_seconds,
+            finished_at=datetime.utcnow()
+        )
+        try:
+            async with async_session() as session:
+                progress = await session.get(DocumentIndexProgress, document_id)
+        except Exception:
+            return
+        if progress is None:
+            return
+        for stage in STAGES:
+            seconds = getattr(progress, f"{stage}_seconds")
+            if seconds is not None:
+                self._timings[stage].append(seconds)
+
+    async def fail(self, document_id: int) -> None:
+        self._last_write.pop(document_id, None)
+        await self._write(document_id, stage="error", finished_at=datetime.utcnow())
+
+    async def for_documents(self, session: AsyncSession, document_ids: Iterable[int]) -> Dict[int, DocumentIndexProgress]:
+        ids = list(document_ids)
+        if not ids:
+            return {}
+        result = await session.execute(
+            select(DocumentIndexProgress).where(DocumentIndexProgress.document_id.in_(ids))
+        )
+        return {progress.document_id: progress for progress in result.scalars()}
+
+    @staticmethod
+    def describe(progress: Optional[DocumentIndexProgress]) -> str:
+        """Короткая строка хода индексации для владельца."""
+        if progress is None:
+            return STAGE_LABELS["queued"]
+        if progress.stage == "indexing" and progress.chunks_total:
+            percent = min(100, progress.chunks_done * 100 // progress.chunks_total)
+            return f"{progress.chunks_done}/{progress.chunks_total} чанков ({percent}%)"
+        return STAGE_LABELS.get(progress.stage, progress.stage)
+
+    async def stats(self) -> Dict[str, Any]:
+        in_stage: Dict[str, int] = {}
+        averages: Dict[str, Optional[float]] = {}
+        try:
+            async with async_session() as session:
+                rows = await session.execute(
+                    select(DocumentIndexProgress.stage, func.count(DocumentIndexProgress.document_id))
+                    .where(DocumentIndexProgress.stage.in_(("queued", "indexing")))
+                    .group_by(DocumentIndexProgress.stage)
+                )
+                in_stage = {stage: count for stage, count in rows.all()}
+                row = (await session.execute(
+                    select(*[func.avg(getattr(DocumentIndexProgress, f"{stage}_seconds")) for stage in STAGES])
+                    .where(
+                        DocumentIndexProgress.stage == "done",
+                        DocumentIndexProgress.finished_at >= datetime.utcnow() - METRICS_PERIOD
+                    )
+                )).one()
+                averages = {stage: round(value, 2) if value is not None else None for stage, value in zip(STAGES, row)}
+        except Exception as e:
+            print(f"⚠️ Не удалось получить метрики прогресса индексации: {e}")
+
+        stats: Dict[str, Any] = {
+            "queued": in_stage.get("queued", 0),
+            "indexing": in_stage.get("indexing", 0),
+        }
+        for stage in STAGES:
+            timings = list(self._timings[stage])
+            stats[f"{stage}_seconds_p50"] = _percentile(timings, 0.5)
+            stats[f"{stage}_seconds_p95"] = _percentile(timings, 0.95)
+            stats[f"{stage}_seconds_avg_24h"] = averages.get(stage)
+        return stats
+
+
+index_progress = IndexProgressTracker()
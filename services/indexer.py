@@ -1,19 +1,26 @@
 import os
 import asyncio
+import queue
+import time
 import uuid
-import pdfplumber
-from docx import Document
-from typing import List
+from contextlib import aclosing
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import update, select
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from fastembed import TextEmbedding, SparseTextEmbedding
 
 from database.db import async_session
 from database.models import AgentDocument, Agent, User
-from core.config import settings
+from core.config import settings, q_client
+from services.chunk_quota import chunk_quota
+from services.index_executor import run_in_index_pool, get_stream_manager
+from services.index_progress import index_progress
+from services.qdrant_writer import PointUploader
+from services.text_pipeline import (
+    ChunkVectors, HashedChunk, chunks_artifact_path, write_chunks_artifact,
+    pdf_page_count, extract_pdf_shard, stream_embedded_batches
+)
 
 # Константы лимитов согласно ТЗ
 CHUNK_LIMITS = {
@@ -22,55 +29,211 @@ CHUNK_LIMITS = {
     "Pro": 1000000  # Условно безлимит
 }
 
-# Инициализация клиентов
-qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
-dense_model = TextEmbedding(model_name="BAAI/bge-small-en-v1.5") 
-sparse_model = SparseTextEmbedding(model_name="prithivida/Splade_PP_en_v1")
+# Как часто чтение потока пачек проверяет, жива ли задача в пуле процессов
+STREAM_POLL_INTERVAL = 1.0  # секунд
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=100,
-    separators=["\n\n", "\n", ".", " ", ""]
-)
+def remove_files(paths: List[str]) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def extract_pdf_parallel(file_path: str) -> Optional[List[str]]:
+    """
+    Извлекает текст большого PDF диапазонами страниц параллельно в пуле процессов.
 
-async def extract_text(file_path: str) -> str:
-    """Извлекает текст в зависимости от расширения файла."""
-    ext = os.path.splitext(file_path)[1].lower()
-    text = ""
-    if ext == ".pdf":
-        with pdfplumber.open(file_path) as pdf:
-            text = "".join([page.extract_text() or "" for page in pdf.pages])
-    elif ext == ".docx":
-        doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-    elif ext == ".txt":
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    return text
-
-async def get_current_chunks_count(agent_id: int) -> int:
-    """Считает количество существующих чанков агента в Qdrant."""
+    Каждый диапазон в PDF_PAGES_PER_SHARD страниц пишется в свой файл-шард; порядок
+    шардов в результате совпадает с порядком страниц. Для PDF из одного диапазона
+    возвращает None: такой файл дешевле разобрать целиком в одном процессе.
+    """
+    pages = await run_in_index_pool(pdf_page_count, file_path)
+    per_shard = settings.PDF_PAGES_PER_SHARD
+    if pages <= per_shard:
+        return None
+
+    shard_paths = []
+    jobs = []
+    for start in range(0, pages, per_shard):
+        end = min(start + per_shard, pages)
+        shard_path = f"{file_path}.pages-{start}-{end}.jsonl"
+        shard_paths.append(shard_path)
+        jobs.append(run_in_index_pool(extract_pdf_shard, file_path, start, end, shard_path))
+    # Дожидаемся всех диапазонов, даже если один упал: иначе шарды допишутся после очистки
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        remove_files(shard_paths)
+        raise errors[0]
+    return shard_paths
+
+async def prepare_document(file_path: str) -> Tuple[int, Dict[str, float]]:
+    """
+    Разбирает загруженный документ в пуле процессов индексации (для проверки лимитов).
+
+    Чанки сохраняются в артефакт рядом с файлом, и индексация берет их оттуда,
+    так что файл парсится ровно один раз. Большие PDF извлекаются параллельно
+    по диапазонам страниц. Возвращает число чанков и время этапов
+    {"extract": ..., "split": ...} в секундах.
+    """
+    shard_paths = None
+    shard_seconds = 0.0
+    if os.path.splitext(file_path)[1].lower() == ".pdf":
+        started = time.monotonic()
+        shard_paths = await extract_pdf_parallel(file_path)
+        shard_seconds = time.monotonic() - started
     try:
-        result = qdrant_client.count(
-            collection_name="agent_documents",
-            count_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="agent_id", 
-                        match=models.MatchValue(value=agent_id)
-                    )
-                ]
+        count, timings = await run_in_index_pool(write_chunks_artifact, file_path, shard_paths)
+    finally:
+        remove_files(shard_paths or [])
+    timings["extract"] += shard_seconds
+    return count, timings
+
+def discard_upload(file_path: str) -> None:
+    """Удаляет загруженный файл вместе с артефактом нарезки."""
+    remove_files([file_path, chunks_artifact_path(file_path)])
+
+def chunk_point_id(document_id: int, text_hash: str) -> str:
+    """
+    ID точки по содержимому чанка: у неизменившегося при замене документа чанка ID тот же,
+    поэтому его не нужно ни эмбеддить, ни загружать заново.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{document_id}_{text_hash}"))
+
+def chunk_location(source: str, page: Optional[int]) -> dict:
+    """Поля payload, зависящие от положения чанка в файле."""
+    # Номер страницы PDF попадает в источник, который видит LLM
+    return {
+        "source": f"{source}, стр. {page}" if page else source,
+        "page": page
+    }
+
+def build_point(
+    chunk_text: str,
+    vectors: ChunkVectors,
+    text_hash: str,
+    agent_id: int,
+    document_id: int,
+    source: str,
+    page: Optional[int] = None
+) -> models.PointStruct:
+    dense_vector, sparse_indices, sparse_values = vectors
+
+    return models.PointStruct(
+        id=chunk_point_id(document_id, text_hash),
+        vector={
+            "": dense_vector,
+            "sparse-text": models.SparseVector(
+                indices=sparse_indices,
+                values=sparse_values
             )
+        },
+        payload={
+            "agent_id": agent_id,
+            "document_id": document_id,
+            "text": chunk_text,
+            "chunk_hash": text_hash,
+            **chunk_location(source, page)
+        }
+    )
+
+async def stream_document_batches(
+    file_path: str,
+    batch_size: int = settings.EMBED_BATCH_SIZE,
+    known_hashes: Optional[Set[str]] = None
+) -> AsyncIterator[Tuple[List[HashedChunk], List[Optional[ChunkVectors]], float]]:
+    """
+    Потоково отдает пачки ([(чанк, страница, хэш)], векторы, секунд на эмбеддинги)
+    документа по мере их готовности в пуле процессов.
+    Для чанков с хэшем из known_hashes и повторов внутри файла векторы не считаются (None).
+
+    Между процессом пула и event loop стоит очередь на INDEX_STREAM_QUEUE_SIZE пачек,
+    поэтому при медленной загрузке в Qdrant воркер ждет, а не копит весь документ в памяти.
+    """
+    loop = asyncio.get_running_loop()
+    manager = await asyncio.to_thread(get_stream_manager)
+    out_queue = manager.Queue(maxsize=settings.INDEX_STREAM_QUEUE_SIZE)
+    stop_event = manager.Event()
+    job = asyncio.ensure_future(
+        run_in_index_pool(stream_embedded_batches, file_path, out_queue, stop_event, batch_size, known_hashes)
+    )
+
+    try:
+        while True:
+            try:
+                kind, chunks, vectors, embed_seconds = await loop.run_in_executor(
+                    None, partial(out_queue.get, timeout=STREAM_POLL_INTERVAL)
+                )
+            except queue.Empty:
+                if not job.done():
+                    continue
+                # Воркер завершился, не отправив "done"/"error" (например, убит по OOM):
+                # пробрасываем ошибку задачи (BrokenProcessPool), чтобы очередь задач повторила индексацию
+                job.result()
+                raise RuntimeError("Процесс индексации завершился, не передав результат")
+            if kind == "done":
+                break
+            if kind == "error":
+                raise ValueError(chunks)
+            yield chunks, vectors, embed_seconds
+    finally:
+        # Если чтение прервано раньше времени, воркер должен перестать ждать места в очереди
+        stop_event.set()
+        await job
+
+def document_filter(document_id: int) -> models.Filter:
+    return models.Filter(
+        must=[models.FieldCondition(key="document_id", match=models.MatchValue(value=document_id))]
+    )
+
+
+async def get_document_points(document_id: int) -> Dict[str, Tuple[Optional[str], dict]]:
+    """Уже проиндексированные точки документа: {id: (хэш чанка, chunk_location точки)}."""
+    points: Dict[str, Tuple[Optional[str], dict]] = {}
+    offset = None
+    while True:
+        records, offset = await q_client.scroll(
+            collection_name="agent_documents",
+            scroll_filter=document_filter(document_id),
+            limit=1000,
+            offset=offset,
+            with_payload=["chunk_hash", "source", "page"],
+            with_vectors=False
         )
-        return result.count
-    except Exception as e:
-        print(f"⚠️ Ошибка при подсчете чанков: {e}")
-        return 0
+        for record in records:
+            payload = record.payload or {}
+            points[str(record.id)] = (
+                payload.get("chunk_hash"),
+                {"source": payload.get("source"), "page": payload.get("page")}
+            )
+        if offset is None:
+            return points
 
-async def process_document(file_path: str, agent_id: int, document_id: int):
+class PermanentIndexingError(ValueError):
+    """Ошибка индексации, которую бессмысленно повторять (нет текста, превышен лимит)."""
+
+
+async def process_document(
+    file_path: str,
+    agent_id: int,
+    document_id: int,
+    file_name: Optional[str] = None,
+    file_id: Optional[str] = None
+):
     """
-    Фоновая задача для обработки документа с проверкой лимитов тарифа.
+    Индексирует документ с проверкой лимитов тарифа и ставит ему статус 'ready'.
+    file_name и file_id новой версии (при замене) записываются в документ только вместе
+    со статусом 'ready': пока индексация не удалась, в поиске и в списке — прежняя версия.
+
+    Индексация инкрементальная: ID точек выводятся из хэша чанка, поэтому при замене
+    документа эмбеддятся и загружаются только новые чанки, у неизменившихся
+    обновляются лишь источник и страница, а исчезнувшие удаляются после загрузки новой версии —
+    агент не остается без этих знаний ни на момент.
+
+    Вызывается воркером очереди задач (services/index_jobs.py): исключения
+    пробрасываются, а повторы, статус 'error' и удаление файла — на стороне очереди.
     """
+    uploader = PointUploader("agent_documents")
+    # Прежнее положение чанков, которым уже переписан payload: {id: chunk_location}
+    relocated: Dict[str, dict] = {}
     try:
         # 1. Получаем информацию о тарифе владельца
         async with async_session() as session:
@@ -79,86 +242,131 @@ async def process_document(file_path: str, agent_id: int, document_id: int):
             user = result.scalar_one_or_none()
             
             if not user:
-                raise ValueError("Владелец агента не найден")
+                raise PermanentIndexingError("Владелец агента не найден")
             
             tariff = user.subscription_type or "Free"
             limit = CHUNK_LIMITS.get(tariff, 100)
 
-        # 2. Извлечение текста и предварительный расчет чанков
-        text = await extract_text(file_path)
-        if not text:
-            raise ValueError("Не удалось извлечь текст из файла")
-
-        chunks = text_splitter.split_text(text)
-        new_chunks_count = len(chunks)
-
-        # 3. Проверка лимитов
-        current_chunks_count = await get_current_chunks_count(agent_id)
-        
-        if current_chunks_count + new_chunks_count > limit:
-            print(f"🚫 Лимит превышен для Agent {agent_id}. Доступно: {limit}, Текущее: {current_chunks_count}, Новое: {new_chunks_count}")
-            async with async_session() as session:
-                await session.execute(
-                    update(AgentDocument)
-                    .where(AgentDocument.id == document_id)
-                    .values(status="error") # Можно добавить спец. статус "limit_exceeded"
-                )
-                await session.commit()
-            return
-
-        # 4. Генерация эмбеддингов и формирование точек для Qdrant
-        points = []
-        for i, chunk_text in enumerate(chunks):
-            dense_vector = list(dense_model.embed([chunk_text]))[0]
-            sparse_vector = list(sparse_model.embed([chunk_text]))[0]
-
-            # UUID на основе document_id и индекса чанка
-            point_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{document_id}_{i}"))
-
-            points.append(
-                models.PointStruct(
-                    id=point_id,
-                    vector={
-                        "": dense_vector.tolist(),
-                        "sparse-text": models.SparseVector(
-                            indices=sparse_vector.indices.tolist(),
-                            values=sparse_vector.values.tolist()
-                        )
-                    },
-                    payload={
-                        "agent_id": agent_id,
-                        "document_id": document_id,
-                        "text": chunk_text,
-                        "source": os.path.basename(file_path)
-                    }
+        # 2. Текущая версия документа (пусто для нового) и сколько чанков документ может занять:
+        # резерв, сделанный при загрузке в учете чанков агента
+        existing = await get_document_points(document_id)
+        available = await chunk_quota.allowance(agent_id, document_id, limit)
+        known_hashes = {text_hash for text_hash, _ in existing.values() if text_hash}
+        await index_progress.start(document_id)
+
+        # 3. Потоковый конвейер: извлечение -> нарезка -> эмбеддинги (в пуле процессов) -> upsert пачками.
+        # Чанки становятся доступны для поиска по мере загрузки, а память не растет с размером файла.
+        source = os.path.basename(file_path)
+        seen_ids: Set[str] = set()
+        embed_seconds = 0.0
+        payload_seconds = 0.0
+        async with aclosing(stream_document_batches(file_path, known_hashes=known_hashes)) as batches:
+            async for chunks, vectors, batch_embed_seconds in batches:
+                embed_seconds += batch_embed_seconds
+                points = []
+                # Неизменившиеся чанки с новым положением, по страницам: {страница: [id]}
+                moved: Dict[Optional[int], List[str]] = {}
+                for (chunk_text, page, text_hash), chunk_vectors in zip(chunks, vectors):
+                    point_id = chunk_point_id(document_id, text_hash)
+                    if point_id in seen_ids:
+                        continue
+                    seen_ids.add(point_id)
+                    if point_id in existing:
+                        # Чанк не изменился; если он сместился на другую страницу или у файла новое имя
+                        # (source включает file_id загрузки) — правим только payload
+                        if existing[point_id][1] != chunk_location(source, page):
+                            moved.setdefault(page, []).append(point_id)
+                        continue
+                    points.append(
+                        build_point(chunk_text, chunk_vectors, text_hash, agent_id, document_id, source, page)
+                    )
+
+                # 4. Проверка лимитов по мере поступления чанков
+                if len(seen_ids) > available:
+                    print(f"🚫 Лимит превышен для Agent {agent_id}. Лимит: {limit}, доступно документу: {available}, Новое: >{len(seen_ids)}")
+                    raise PermanentIndexingError("Превышен лимит чанков тарифа")
+
+                # 5. Загрузка в Qdrant: пачками по QDRANT_UPSERT_BATCH_SIZE, несколько в полете
+                if points:
+                    await uploader.add(points)
+                if moved:
+                    started = time.monotonic()
+                    await q_client.batch_update_points(
+                        collection_name="agent_documents",
+                        update_operations=[
+                            models.SetPayloadOperation(
+                                set_payload=models.SetPayload(payload=chunk_location(source, page), points=point_ids)
+                            )
+                            for page, point_ids in moved.items()
+                        ]
+                    )
+                    for point_ids in moved.values():
+                        relocated.update((point_id, existing[point_id][1]) for point_id in point_ids)
+                    payload_seconds += time.monotonic() - started
+
+                await index_progress.advance(
+                    document_id, len(seen_ids), embed_seconds, uploader.busy_seconds + payload_seconds
                 )
+
+        if not seen_ids:
+            raise PermanentIndexingError("Не удалось извлечь текст из файла")
+
+        # Барьер: дальше (удаление старых чанков, статус 'ready') — только когда все новые точки видны в поиске
+        upload_started = time.monotonic()
+        await uploader.flush()
+        if uploader.points:
+            print(
+                f"📤 Документ {document_id}: загружено точек {uploader.points}, "
+                f"{uploader.points_per_second()} точек/сек в Qdrant, барьер {time.monotonic() - upload_started:.2f} с"
             )
 
-        # 5. Загрузка в Qdrant
-        qdrant_client.upsert(
-            collection_name="agent_documents",
-            points=points
-        )
+        # 6. Чанки, которых нет в новой версии, удаляем только после загрузки новых
+        vanished = [point_id for point_id in existing if point_id not in seen_ids]
+        if vanished:
+            await q_client.delete(
+                collection_name="agent_documents",
+                points_selector=models.PointIdsList(points=vanished)
+            )
+        if existing:
+            print(
+                f"🔄 Документ {document_id} обновлен: новых чанков {uploader.points}, "
+                f"без изменений {len(seen_ids) - uploader.points}, удалено {len(vanished)}"
+            )
 
-        # 6. Обновление статуса в БД на 'ready'
+        # 7. Резерв превращается в фактическое число чанков, статус в БД — 'ready' (и имя новой версии)
+        await chunk_quota.commit(agent_id, document_id, len(seen_ids))
+        replacement = {"file_name": file_name, "file_id": file_id} if file_name else {}
         async with async_session() as session:
             await session.execute(
                 update(AgentDocument)
                 .where(AgentDocument.id == document_id)
-                .values(status="ready")
+                .values(status="ready", **replacement)
             )
             await session.commit()
+        await index_progress.finish(document_id, len(seen_ids), embed_seconds, uploader.busy_seconds + payload_seconds)
 
-    except Exception as e:
-        print(f"❌ Ошибка при индексации документа {document_id}: {e}")
-        async with async_session() as session:
-            await session.execute(
-                update(AgentDocument)
-                .where(AgentDocument.id == document_id)
-                .values(status="error")
+    except Exception:
+        # Убираем только что загруженные чанки: новый документ не останется наполовину
+        # проиндексированным, а у заменяемого сохранится предыдущая версия.
+        # Сначала дожидаемся пачек в полете, иначе они могут лечь уже после удаления
+        await uploader.abort()
+        if uploader.submitted_ids:
+            await q_client.delete(
+                collection_name="agent_documents",
+                points_selector=models.PointIdsList(points=uploader.submitted_ids)
             )
-            await session.commit()
-    finally:
-        # Удаляем временный файл после обработки
-        if os.path.exists(file_path):
-            os.remove(file_path)
\ No newline at end of file
+        # Неизменившимся чанкам возвращаем источник и страницу предыдущей версии
+        if relocated:
+            previous: Dict[Tuple[Optional[str], Optional[int]], List[str]] = {}
+            for point_id, location in relocated.items():
+                previous.setdefault((location["source"], location["page"]), []).append(point_id)
+            await q_client.batch_update_points(
+                collection_name="agent_documents",
+                update_operations=[
+                    models.SetPayloadOperation(
+                        set_payload=models.SetPayload(payload={"source": old_source, "page": old_page}, points=point_ids)
+                    )
+                    for (old_source, old_page), point_ids in previous.items()
+                ]
+            )
+        raise
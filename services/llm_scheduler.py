@@ -0,0 +1,146 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from core.config import settings
+
+# Веса тарифов для справедливого распределения слотов LLM (те же тарифы, что и в CHUNK_LIMITS)
+TIER_WEIGHTS = {
+    "Free": 1,
+    "Advanced": 3,
+    "Pro": 10
+}
+# С какого числа сохраненных меток окончания начинается их чистка
+FINISH_TAGS_SWEEP = 1000
+
+
+class FairLLMScheduler:
+    """
+    Взвешенная справедливая очередь (start-time fair queuing) перед поиском и LLM.
+
+    Одновременно выполняется не более concurrency запросов. Когда слотов нет,
+    следующим получает слот запрос с наименьшей виртуальной меткой окончания:
+    каждый запрос агента сдвигает его метку на 1/вес тарифа, поэтому «вирусный»
+    агент не может вытеснить остальных, а Pro получает в 10 раз больше слотов, чем Free.
+
+    Статистика хранится только для агентов с запросами в очереди или в работе,
+    поэтому память и /metrics не растут с числом агентов; итоги — по всем агентам.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._running = 0
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[int, float] = {}
+        self._sweep_at = FINISH_TAGS_SWEEP
+        # (метка окончания, порядковый номер, метка начала, future ожидающего)
+        self._heap: List[Tuple[float, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._agents: Dict[int, Dict[str, float]] = {}
+        self.served = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @asynccontextmanager
+    async def slot(self, agent_id: int, tier: Optional[str]) -> AsyncIterator[None]:
+        """Ждет своей очереди и занимает слот на время блока."""
+        weight = TIER_WEIGHTS.get(tier or "Free", 1)
+        start_tag = max(self._virtual_time, self._finish_tags.get(agent_id, 0.0))
+        finish_tag = start_tag + 1 / weight
+        self._finish_tags[agent_id] = finish_tag
+
+        stats = self._agents.setdefault(
+            agent_id, {"queued": 0, "inflight": 0, "served": 0, "wait_total": 0.0, "wait_max": 0.0}
+        )
+        enqueued_at = time.monotonic()
+
+        if self._running < self.concurrency and not self._heap:
+            self._running += 1
+            self._virtual_time = start_tag
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (finish_tag, next(self._seq), start_tag, waiter))
+            stats["queued"] += 1
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Слот мог быть выдан уже после отмены — возвращаем его
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                stats["queued"] -= 1
+                self._forget_idle(agent_id, stats)
+                raise
+            stats["queued"] -= 1
+
+        wait = time.monotonic() - enqueued_at
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        stats["inflight"] += 1
+        try:
+            yield
+        finally:
+            stats["inflight"] -= 1
+            stats["served"] += 1
+            self.served += 1
+            self._release()
+            self._forget_idle(agent_id, stats)
+
+    def _forget_idle(self, agent_id: int, stats: Dict[str, float]) -> None:
+        """Агент без запросов в очереди и в работе больше не хранится."""
+        if stats["queued"] or stats["inflight"]:
+            return
+        self._agents.pop(agent_id, None)
+        if not self._running and not self._heap:
+            # Планировщик простаивает: прошлые метки ни на что не влияют
+            self._finish_tags.clear()
+        elif self._finish_tags.get(agent_id, 0) <= self._virtual_time:
+            # Метка простаивающего агента больше не нужна: следующий запрос начнет с виртуального времени
+            self._finish_tags.pop(agent_id, None)
+        elif len(self._finish_tags) > self._sweep_at:
+            # Метки накопились (новые агенты начинают с виртуального времени и не дают ему уйти вперед):
+            # оставляем только агентов с запросами в очереди или в работе. Простаивающий агент
+            # не занимает слотов, поэтому потеря его метки не дает ему обойти остальных.
+            # Порог растет вдвое, чтобы при множестве активных агентов чистка не шла на каждом запросе
+            self._finish_tags = {
+                agent: tag for agent, tag in self._finish_tags.items() if agent in self._agents
+            }
+            self._sweep_at = max(FINISH_TAGS_SWEEP, 2 * len(self._finish_tags))
+
+    def _release(self) -> None:
+        self._running -= 1
+        while self._heap:
+            _, _, start_tag, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled():
+                continue
+            self._virtual_time = start_tag
+            self._running += 1
+            waiter.set_result(None)
+            break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "queued": len(self._heap),
+            "served": self.served,
+            "avg_wait_ms": round(self._wait_total / self.served * 1000, 2) if self.served else 0,
+            "max_wait_ms": round(self._wait_max * 1000, 2),
+            "agents": {
+                agent_id: {
+                    "queued": stats["queued"],
+                    "inflight": stats["inflight"],
+                    "served": stats["served"],
+                    "avg_wait_ms": round(stats["wait_total"] / stats["served"] * 1000, 2) if stats["served"] else 0,
+                    "max_wait_ms": round(stats["wait_max"] * 1000, 2)
+                }
+                for agent_id, stats in self._agents.items()
+            }
+        }
+
+
+llm_scheduler = FairLLMScheduler(concurrency=settings.LLM_MAX_CONCURRENCY)
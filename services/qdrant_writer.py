@@ -0,0 +1,151 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http import models
+
+from core.config import q_client, settings
+
+# Базовая задержка перед повтором пачки, удваивается с каждой попыткой
+UPSERT_RETRY_DELAY = 0.5
+
+
+class UpsertStats:
+    """Сводная пропускная способность загрузки точек в Qdrant (для /metrics)."""
+
+    def __init__(self):
+        self.documents = 0
+        self.points = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed_batches = 0
+        self.busy_seconds = 0.0
+        self.last_points_per_second: Optional[float] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": self.documents,
+            "points": self.points,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed_batches": self.failed_batches,
+            "points_per_second": round(self.points / self.busy_seconds, 1) if self.busy_seconds else None,
+            "last_document_points_per_second": self.last_points_per_second
+        }
+
+
+upsert_stats = UpsertStats()
+
+
+class PointUploader:
+    """
+    Конвейерная загрузка точек одного документа в Qdrant.
+
+    Точки копятся до batch_size и уходят отдельными upsert, одновременно в полете
+    не больше max_in_flight пачек. Пачки отправляются с wait=False (Qdrant подтверждает
+    запись в WAL, не дожидаясь индексации), а последняя — с wait=True уже после
+    подтверждения всех остальных: операции шарда применяются по порядку, поэтому
+    после flush() все точки документа видны в поиске. ID точек детерминированы,
+    так что повтор пачки после ошибки идемпотентен.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        batch_size: int = settings.QDRANT_UPSERT_BATCH_SIZE,
+        max_in_flight: int = settings.QDRANT_UPSERT_IN_FLIGHT,
+        retries: int = settings.QDRANT_UPSERT_RETRIES,
+        wait: bool = settings.QDRANT_UPSERT_WAIT,
+        client: Optional[AsyncQdrantClient] = None
+    ):
+        self.collection_name = collection_name
+        self.client = client or q_client
+        self.batch_size = batch_size
+        self.retries = retries
+        self.wait = wait
+        self._buffer: List[models.PointStruct] = []
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks: Set[asyncio.Task] = set()
+        self._error: Optional[BaseException] = None
+        self.submitted_ids: List[Any] = []
+
+        self.points = 0
+        self._in_flight = 0
+        self._busy_since = 0.0
+        self.busy_seconds = 0.0
+
+    async def add(self, points: List[models.PointStruct]) -> None:
+        self._raise_if_failed()
+        self._buffer.extend(points)
+        # Строго больше: в буфере всегда остается хотя бы одна точка для барьерной пачки в flush()
+        while len(self._buffer) > self.batch_size:
+            batch = self._buffer[:self.batch_size]
+            self._buffer = self._buffer[self.batch_size:]
+            await self._submit(batch, wait=self.wait)
+
+    async def _submit(self, batch: List[models.PointStruct], wait: bool) -> None:
+        # Ждем свободный слот: так в памяти и в полете не больше max_in_flight пачек
+        await self._slots.acquire()
+        self._raise_if_failed()
+        self.submitted_ids.extend(point.id for point in batch)
+        task = asyncio.create_task(self._upsert(batch, wait))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _upsert(self, batch: List[models.PointStruct], wait: bool) -> None:
+        if self._in_flight == 0:
+            self._busy_since = time.monotonic()
+        self._in_flight += 1
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    await self.client.upsert(collection_name=self.collection_name, points=batch, wait=wait)
+                    upsert_stats.batches += 1
+                    self.points += len(batch)
+                    return
+                except Exception as e:
+                    if attempt == self.retries:
+                        upsert_stats.failed_batches += 1
+                        self._error = self._error or e
+                        return
+                    upsert_stats.retries += 1
+                    print(f"⚠️ Повтор загрузки пачки из {len(batch)} точек в Qdrant: {e}")
+                    await asyncio.sleep(UPSERT_RETRY_DELAY * 2 ** attempt)
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.busy_seconds += time.monotonic() - self._busy_since
+            self._slots.release()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    async def flush(self) -> None:
+        """Отправляет остаток и ждет, пока все точки документа станут видны в Qdrant."""
+        last_batch = self._buffer
+        self._buffer = []
+        # Барьер: последняя пачка уходит с wait=True только после подтверждения всех предыдущих
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        self._raise_if_failed()
+        if last_batch:
+            await self._submit(last_batch, wait=True)
+            await asyncio.gather(*self._tasks)
+            self._raise_if_failed()
+
+        upsert_stats.documents += 1
+        upsert_stats.points += self.points
+        upsert_stats.busy_seconds += self.busy_seconds
+        if self.busy_seconds:
+            upsert_stats.last_points_per_second = round(self.points / self.busy_seconds, 1)
+
+    async def abort(self) -> None:
+        """Дожидается пачек в полете (без новых отправок), чтобы после этого их можно было удалить."""
+        self._buffer = []
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def points_per_second(self) -> Optional[float]:
+        return round(self.points / self.busy_seconds, 1) if self.busy_seconds else None
@@ -1,28 +1,157 @@
-import os
-from typing import List, Dict, Any
-from qdrant_client import AsyncQdrantClient
+import asyncio
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from qdrant_client.http import models
-from fastembed import TextEmbedding, SparseTextEmbedding
 from services.ai_service import rewrite_query
-from core.config import q_client
+from services.embeddings import embedding_models
+from core.config import q_client, settings
 
-# Инициализируем асинхронный клиент
-q_client = AsyncQdrantClient(
-    url=os.getenv("QDRANT_URL"), 
-    api_key=os.getenv("QDRANT_API_KEY")
-)
+SPARSE_VECTOR_NAME = "sparse-text"
+
+FUSIONS = {
+    "rrf": models.Fusion.RRF,
+    "dbsf": models.Fusion.DBSF
+}
+
+
+# Оценка накладных расходов записи кэша сверх самих векторов (объекты, ключ в OrderedDict)
+QUERY_CACHE_ENTRY_OVERHEAD = 200
+
+
+class QueryEmbeddingCache:
+    """
+    LRU-кэш эмбеддингов запросов: нормализованный текст -> dense и (для гибридного поиска) sparse.
+
+    Общий для всех агентов: вектор зависит только от текста. Размер ограничен в байтах:
+    векторы хранятся компактно (array float32/int32), а при превышении лимита вытесняются
+    давно не использованные записи. Вызывается из потоков (encode_query в asyncio.to_thread).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[array, Optional[array], Optional[array], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # Модели не различают регистр, а лишние пробелы не меняют смысл
+        return " ".join(query.split()).casefold()
+
+    def get(self, key: str, hybrid: bool) -> Optional[Tuple[List[float], Optional[models.SparseVector]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (hybrid and entry[1] is None):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        dense, indices, values, _ = entry
+        sparse = models.SparseVector(indices=indices.tolist(), values=values.tolist()) if hybrid else None
+        return dense.tolist(), sparse
+
+    def put(self, key: str, dense_vector: List[float], sparse_vector: Optional[models.SparseVector]) -> None:
+        dense = array("f", dense_vector)
+        indices = values = None
+        size = len(key) + dense.itemsize * len(dense) + QUERY_CACHE_ENTRY_OVERHEAD
+        if sparse_vector is not None:
+            indices = array("i", sparse_vector.indices)
+            values = array("f", sparse_vector.values)
+            size += indices.itemsize * len(indices) + values.itemsize * len(values)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[3]
+            self._entries[key] = (dense, indices, values, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, _, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.max_bytes > 0,
+            "entries": len(self._entries),
+            "size_mb": round(self.size / 1024 / 1024, 2),
+            "max_size_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions
+        }
+
+
+query_embedding_cache = QueryEmbeddingCache(max_bytes=settings.QUERY_EMBED_CACHE_MB * 1024 * 1024)
+
+
+def encode_query(query: str, hybrid: bool = True) -> Tuple[List[float], Optional[models.SparseVector]]:
+    """
+    Эмбеддинги запроса общими моделями процесса: dense и, для гибридного поиска, SPLADE.
+    Повторяющиеся запросы (после нормализации) берутся из query_embedding_cache.
+    """
+    text = QueryEmbeddingCache.normalize(query)
+    cached = query_embedding_cache.get(text, hybrid)
+    if cached is not None:
+        return cached
+
+    dense_vector = next(iter(embedding_models.dense().embed([text]))).tolist()
+    sparse_vector = None
+    if hybrid:
+        sparse = next(iter(embedding_models.sparse().embed([text])))
+        sparse_vector = models.SparseVector(indices=sparse.indices.tolist(), values=sparse.values.tolist())
+    query_embedding_cache.put(text, dense_vector, sparse_vector)
+    return dense_vector, sparse_vector
+
+
+def build_search_request(
+    dense_vector: List[float],
+    sparse_vector: Optional[models.SparseVector],
+    query_filter: models.Filter,
+    limit: int,
+    fusion: str = settings.SEARCH_FUSION,
+    prefetch_limit: int = settings.SEARCH_PREFETCH_LIMIT
+) -> Dict[str, Any]:
+    """
+    Аргументы query_points. С sparse-вектором — гибридный запрос: ветки dense и SPLADE
+    в prefetch и слияние результатов (RRF или DBSF) на стороне Qdrant за один запрос.
+    """
+    if sparse_vector is None:
+        return {"query": dense_vector, "query_filter": query_filter, "limit": limit}
+    return {
+        "prefetch": [
+            models.Prefetch(query=dense_vector, filter=query_filter, limit=max(prefetch_limit, limit)),
+            models.Prefetch(
+                query=sparse_vector, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=max(prefetch_limit, limit)
+            ),
+        ],
+        "query": models.FusionQuery(fusion=FUSIONS[fusion]),
+        "limit": limit
+    }
 
-dense_model = TextEmbedding(model_name="BAAI/bge-small-en-v1.5")
-sparse_model = SparseTextEmbedding(model_name="prithivida/Splade_PP_en_v1")
 
 async def search_knowledge_base(query: str, agent_id: int, limit: int = 5) -> List[Dict[str, Any]]:
-    """Поиск по базе знаний с использованием актуального API query_points."""
+    """Поиск по базе знаний: гибридный (dense + SPLADE) или только dense, по SEARCH_MODE."""
     try:
         # 1. Переписываем запрос (LLM)
         optimized_query = await rewrite_query(query)
         
-        # 2. Генерируем эмбеддинг
-        dense_vector = list(dense_model.embed([optimized_query]))[0].tolist()
+        # 2. Генерируем эмбеддинги (модели общие для всего процесса), не блокируя event loop
+        hybrid = settings.SEARCH_MODE == "hybrid"
+        dense_vector, sparse_vector = await asyncio.to_thread(encode_query, optimized_query, hybrid)
 
         # 3. Фильтр по конкретному агенту
         search_filter = models.Filter(
@@ -34,13 +163,11 @@ async def search_knowledge_base(query: str, agent_id: int, limit: int = 5) -> Li
             ]
         )
 
-        # 4. ВАЖНО: Используем новый метод query_points вместо удаленного search
+        # 4. Один запрос query_points; в гибридном режиме слияние веток делает Qdrant
         response = await q_client.query_points(
             collection_name="agent_documents",
-            query=dense_vector,
-            query_filter=search_filter,
-            limit=limit,
-            with_payload=True
+            with_payload=True,
+            **build_search_request(dense_vector, sparse_vector, search_filter, limit)
         )
 
         # 5. Сбор результатов (они теперь лежат внутри response.points)
@@ -0,0 +1,386 @@
+"""
+CPU-часть индексации: извлечение текста, нарезка на чанки и эмбеддинги.
+
+Функции модуля синхронные и выполняются в процессах пула индексации
+(services/index_executor.py), поэтому модуль не импортирует БД, Qdrant и aiogram.
+"""
+import bisect
+import hashlib
+import json
+import os
+import queue
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import pdfplumber
+from docx import Document
+
+from services.chunker import TextChunker
+from services.embedding_cache import (
+    EmbeddingCache, decode_dense, decode_sparse, encode_dense, encode_sparse, text_key
+)
+from services.embeddings import DENSE_MODEL_NAME, SPARSE_MODEL_NAME, embedding_models
+
+# dense-вектор, индексы и значения sparse-вектора (простые списки — дешево передавать между процессами)
+ChunkVectors = Tuple[List[float], List[int], List[float]]
+
+# Часть текста файла и номер страницы PDF, к которой она относится (None для DOCX/TXT)
+PageSegment = Tuple[Optional[int], str]
+# Чанк и номер страницы, на которой он начинается
+LocatedChunk = Tuple[str, Optional[int]]
+# Чанк, смещения его начала и конца в тексте документа и страница начала
+SpanChunk = Tuple[str, int, int, Optional[int]]
+# Чанк, страница и sha256 текста чанка
+HashedChunk = Tuple[str, Optional[int], str]
+
+# Разделитель страниц PDF в извлеченном тексте
+PAGE_SEPARATOR = "\n\n"
+# Сколько символов копится перед очередным вызовом сплиттера в потоковом режиме
+STREAM_BUFFER_CHARS = 20000
+# Предел буфера для текста без пустых строк: дальше он режется по лучшему найденному разделителю
+STREAM_MAX_BUFFER_CHARS = 1000000
+# Сколько символов .txt читается за раз
+TXT_READ_CHARS = 64 * 1024
+# Артефакт нарезки рядом с загруженным файлом: JSONL с текстом и sha256 каждого чанка
+CHUNKS_ARTIFACT_SUFFIX = ".chunks.jsonl"
+
+text_splitter = TextChunker(
+    chunk_size=1000,
+    chunk_overlap=100,
+    separators=["\n\n", "\n", ".", " ", ""]
+)
+
+
+# Кэш эмбеддингов процесса; настраивается init_worker (в основном процессе кэша нет)
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def preload_models() -> None:
+    """Модели загружаются один раз на воркер."""
+    embedding_models.warm_up()
+
+
+def init_worker(cache_path: str, cache_max_bytes: int) -> None:
+    """Инициализатор процесса пула: кэш эмбеддингов (если задан путь) и модели."""
+    global _embedding_cache
+    if cache_path:
+        _embedding_cache = EmbeddingCache(cache_path, cache_max_bytes)
+    preload_models()
+
+
+def iter_pdf_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Отдает (номер страницы с 1, текст) для страниц PDF с индексами [start, end)."""
+    with pdfplumber.open(file_path) as pdf:
+        for index, page in enumerate(pdf.pages[start:end], start=start):
+            yield index + 1, page.extract_text() or ""
+            # Освобождаем разобранные объекты страницы, иначе pdfplumber держит их до закрытия файла
+            page.close()
+
+
+def pdf_page_count(file_path: str) -> int:
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_shard(file_path: str, start: int, end: int, shard_path: str) -> str:
+    """Извлекает текст диапазона страниц PDF в файл-шард (JSONL: номер страницы и текст)."""
+    with open(shard_path, "w", encoding="utf-8") as f:
+        for page_number, text in iter_pdf_pages(file_path, start, end):
+            f.write(json.dumps({"page": page_number, "text": text}, ensure_ascii=False) + "\n")
+    return shard_path
+
+
+def iter_shard_pages(shard_paths: List[str]) -> Iterator[Tuple[int, str]]:
+    """Читает шарды по порядку: страницы собираются в исходной последовательности."""
+    for shard_path in shard_paths:
+        with open(shard_path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                yield record["page"], record["text"]
+
+
+def _separate_pages(pages: Iterable[Tuple[int, str]]) -> Iterator[PageSegment]:
+    for i, (page_number, text) in enumerate(pages):
+        yield page_number, text if i == 0 else PAGE_SEPARATOR + text
+
+
+def iter_page_segments(file_path: str) -> Iterator[PageSegment]:
+    """
+    Отдает текст файла по частям (страницы PDF, абзацы DOCX, блоки TXT) вместе
+    с номером страницы (только для PDF, для остальных форматов — None).
+
+    Конкатенация частей равна extract_text_sync(file_path), но в памяти
+    одновременно находится только одна часть.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".pdf":
+        yield from _separate_pages(iter_pdf_pages(file_path))
+    elif ext == ".docx":
+        doc = Document(file_path)
+        for i, para in enumerate(doc.paragraphs):
+            yield None, para.text if i == 0 else "\n" + para.text
+    elif ext == ".txt":
+        with open(file_path, "r", encoding="utf-8") as f:
+            while block := f.read(TXT_READ_CHARS):
+                yield None, block
+
+
+def iter_text_segments(file_path: str) -> Iterator[str]:
+    for _, segment in iter_page_segments(file_path):
+        yield segment
+
+
+def extract_text_sync(file_path: str) -> str:
+    """Извлекает текст в зависимости от расширения файла (страницы PDF разделены пустой строкой)."""
+    return "".join(iter_text_segments(file_path))
+
+
+def iter_chunk_spans(segments: Iterable[str], buffer_chars: int = STREAM_BUFFER_CHARS) -> Iterator[Tuple[str, int, int]]:
+    """
+    Инкрементальная нарезка: копит текст до buffer_chars и отдает чанки, которые
+    уже не изменятся (TextChunker.split_prefix), вместе со смещениями начала и конца
+    в тексте. Остаток буфера переносится в следующий, поэтому чанки совпадают
+    с нарезкой всего текста целиком.
+    """
+    buffer = ""
+    # Позиция buffer[0] во всем тексте
+    base = 0
+    # Разделитель верхнего уровня, выбранный для всего текста
+    separator: Optional[str] = None
+    # Следующая попытка нарезки — когда в буфере наберется еще buffer_chars символов
+    # (иначе текст без пустых строк, например DOCX, пересматривался бы на каждом абзаце)
+    threshold = buffer_chars
+
+    for segment in segments:
+        buffer += segment
+        if len(buffer) < threshold:
+            continue
+
+        spans, restart, separator = text_splitter.split_prefix(
+            buffer, separator, force=len(buffer) >= STREAM_MAX_BUFFER_CHARS
+        )
+        for start, end in spans:
+            yield buffer[start:end], base + start, base + end
+        if restart:
+            base += restart
+            buffer = buffer[restart:]
+        threshold = len(buffer) + buffer_chars
+
+    if buffer:
+        for start, end in text_splitter.split_spans(buffer, separator):
+            yield buffer[start:end], base + start, base + end
+
+
+def iter_page_chunks(page_segments: Iterable[PageSegment], buffer_chars: int = STREAM_BUFFER_CHARS) -> Iterator[SpanChunk]:
+    """Нарезка со смещениями чанка и номером страницы, на которой он начинается."""
+    page_starts: List[int] = []
+    page_numbers: List[Optional[int]] = []
+    offset = 0
+
+    def segments() -> Iterator[str]:
+        nonlocal offset
+        for page_number, segment in page_segments:
+            if page_number is not None and (not page_numbers or page_numbers[-1] != page_number):
+                page_starts.append(offset)
+                page_numbers.append(page_number)
+            offset += len(segment)
+            yield segment
+
+    for chunk, start, end in iter_chunk_spans(segments(), buffer_chars):
+        index = bisect.bisect_right(page_starts, start) - 1
+        yield chunk, start, end, page_numbers[index] if index >= 0 else None
+
+
+def iter_located_chunks(page_segments: Iterable[PageSegment], buffer_chars: int = STREAM_BUFFER_CHARS) -> Iterator[LocatedChunk]:
+    """Нарезка с номером страницы, на которой начинается каждый чанк."""
+    for chunk, _, _, page_number in iter_page_chunks(page_segments, buffer_chars):
+        yield chunk, page_number
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunks_artifact_path(file_path: str) -> str:
+    return file_path + CHUNKS_ARTIFACT_SUFFIX
+
+
+def write_chunks_artifact(file_path: str, shard_paths: Optional[List[str]] = None) -> Tuple[int, Dict[str, float]]:
+    """
+    Единственный разбор загруженного файла: чанки построчно пишутся в артефакт,
+    из которого потом читает индексация. Возвращает число чанков
+    и время этапов {"extract": ..., "split": ...} в секундах (извлечение и нарезка
+    идут вперемешку, поэтому время извлечения считается по ожиданию очередной части).
+    В памяти не держится ни весь текст, ни список чанков.
+
+    shard_paths — страницы PDF, заранее извлеченные параллельно (extract_pdf_shard).
+    """
+    started = time.perf_counter()
+    extract_seconds = 0.0
+    if shard_paths:
+        page_segments = _separate_pages(iter_shard_pages(shard_paths))
+    else:
+        page_segments = iter_page_segments(file_path)
+
+    def timed_segments() -> Iterator[PageSegment]:
+        nonlocal extract_seconds
+        while True:
+            waited = time.perf_counter()
+            item = next(page_segments, None)
+            extract_seconds += time.perf_counter() - waited
+            if item is None:
+                return
+            yield item
+
+    artifact_path = chunks_artifact_path(file_path)
+    tmp_path = artifact_path + ".tmp"
+    count = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for chunk, page_number in iter_located_chunks(timed_segments()):
+                record = {
+                    "text": chunk,
+                    "hash": chunk_hash(chunk),
+                    "page": page_number
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        # Индексация видит артефакт только целиком
+        os.replace(tmp_path, artifact_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    timings = {"extract": extract_seconds, "split": time.perf_counter() - started - extract_seconds}
+    return count, timings
+
+
+def iter_artifact_chunks(artifact_path: str) -> Iterator[LocatedChunk]:
+    with open(artifact_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            yield record["text"], record.get("page")
+
+
+def iter_document_chunks(file_path: str) -> Iterator[LocatedChunk]:
+    """Чанки документа: из артефакта проверки лимитов, а если его нет — разбором файла."""
+    artifact_path = chunks_artifact_path(file_path)
+    if os.path.exists(artifact_path):
+        return iter_artifact_chunks(artifact_path)
+    return iter_located_chunks(iter_page_segments(file_path))
+
+
+def _embed_with_cache(model_name: str, texts: List[str], compute, encode, decode) -> List[Any]:
+    """
+    Векторы texts одной модели: из кэша по sha256 текста, в модель — только промахи
+    (и только уникальные тексты).
+    """
+    if _embedding_cache is None:
+        return compute(texts)
+
+    keys = [text_key(text) for text in texts]
+    cached = _embedding_cache.get_many(model_name, keys)
+    missing: Dict[bytes, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+
+    vectors = {key: decode(blob) for key, blob in cached.items()}
+    if missing:
+        computed = compute(list(missing.values()))
+        fresh = dict(zip(missing, computed))
+        _embedding_cache.put_many(model_name, {key: encode(vector) for key, vector in fresh.items()})
+        vectors.update(fresh)
+    return [vectors[key] for key in keys]
+
+
+def embed_texts(texts: List[str], batch_size: int, parallel: Optional[int] = None) -> List[ChunkVectors]:
+    """Считает dense и sparse эмбеддинги пачки текстов одним вызовом каждой модели."""
+    def compute_dense(batch: List[str]) -> List[List[float]]:
+        return [
+            vector.tolist()
+            for vector in embedding_models.dense().embed(batch, batch_size=batch_size, parallel=parallel)
+        ]
+
+    def compute_sparse(batch: List[str]) -> List[Tuple[List[int], List[float]]]:
+        return [
+            (vector.indices.tolist(), vector.values.tolist())
+            for vector in embedding_models.sparse().embed(batch, batch_size=batch_size, parallel=parallel)
+        ]
+
+    dense_vectors = _embed_with_cache(DENSE_MODEL_NAME, texts, compute_dense, encode_dense, decode_dense)
+    sparse_vectors = _embed_with_cache(SPARSE_MODEL_NAME, texts, compute_sparse, encode_sparse, decode_sparse)
+    return [
+        (dense_vector, sparse_indices, sparse_values)
+        for dense_vector, (sparse_indices, sparse_values) in zip(dense_vectors, sparse_vectors)
+    ]
+
+
+class StreamStopped(Exception):
+    """Потребитель потока пачек прекратил чтение."""
+
+
+def _put(out_queue: Any, item: Tuple, stop_event: Any) -> None:
+    # Очередь ограничена: ждем места, но регулярно проверяем, не остановлен ли поток
+    while True:
+        if stop_event.is_set():
+            raise StreamStopped()
+        try:
+            out_queue.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _embed_new_chunks(batch: List[HashedChunk], known_hashes: Set[str], batch_size: int) -> List[Optional[ChunkVectors]]:
+    """Эмбеддинги только для чанков с еще не встречавшимся хэшем; для остальных — None."""
+    fresh = []
+    for i, (_, _, text_hash) in enumerate(batch):
+        if text_hash not in known_hashes:
+            known_hashes.add(text_hash)
+            fresh.append(i)
+
+    vectors: List[Optional[ChunkVectors]] = [None] * len(batch)
+    if fresh:
+        for i, chunk_vectors in zip(fresh, embed_texts([batch[i][0] for i in fresh], batch_size)):
+            vectors[i] = chunk_vectors
+    return vectors
+
+
+def stream_embedded_batches(
+    file_path: str,
+    out_queue: Any,
+    stop_event: Any,
+    batch_size: int,
+    known_hashes: Optional[Set[str]] = None
+) -> None:
+    """
+    Потоковый конвейер в процессе пула: чанки (из артефакта или инкрементальной
+    нарезкой файла) -> пакетные эмбеддинги -> ограниченная очередь к event loop.
+
+    Сообщения очереди: ("batch", [(чанк, страница, хэш)], векторы, секунд на эмбеддинги),
+    ("done", None, None, 0), ("error", текст, None, 0). Чанки, хэш которых есть в known_hashes (уже проиндексированы
+    у этого документа) или уже встречался в файле, не эмбеддятся: вектор для них None.
+    Пиковая память не зависит от размера файла: она ограничена буфером сплиттера
+    и maxsize очереди.
+    """
+    known = set(known_hashes or ())
+
+    def send(batch: List[HashedChunk]) -> None:
+        started = time.perf_counter()
+        vectors = _embed_new_chunks(batch, known, batch_size)
+        _put(out_queue, ("batch", batch, vectors, time.perf_counter() - started), stop_event)
+
+    try:
+        batch: List[HashedChunk] = []
+        for text, page in iter_document_chunks(file_path):
+            batch.append((text, page, chunk_hash(text)))
+            if len(batch) >= batch_size:
+                send(batch)
+                batch = []
+        if batch:
+            send(batch)
+        _put(out_queue, ("done", None, None, 0), stop_event)
+    except StreamStopped:
+        return
+    except Exception as e:
+        _put(out_queue, ("error", str(e), None, 0), stop_event)
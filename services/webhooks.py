@@ -0,0 +1,124 @@
+import asyncio
+import time
+from typing import Any, Dict, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from sqlalchemy import func, select
+
+from core.bot_pool import agent_bot_pool
+from core.config import settings
+from core.crypto import decrypt_token
+from database.db import async_session
+from database.models import Agent
+
+# Сколько раз повторяем вызов Telegram API после TelegramRetryAfter
+MAX_RETRY_AFTER_ATTEMPTS = 3
+
+
+class WebhookReconciler:
+    """
+    Сверка вебхуков всех активных агентов с текущим BASE_URL при старте.
+
+    Агенты читаются из БД потоком, для каждого сравнивается get_webhook_info
+    с ожидаемым URL, и переустанавливаются только расходящиеся вебхуки.
+    Параллелизм ограничен, ответы 429 (RetryAfter) обрабатываются ожиданием.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._reset()
+
+    def _reset(self) -> None:
+        self.status = "idle"  # idle, running, done, error
+        self.total = 0
+        self.checked = 0
+        self.updated = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.started_at = None
+        self.finished_at = None
+
+    async def run(self) -> None:
+        self._reset()
+        self.status = "running"
+        self.started_at = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+
+        try:
+            async with async_session() as session:
+                count_res = await session.execute(
+                    select(func.count(Agent.id)).where(Agent.is_active == True)
+                )
+                self.total = count_res.scalar() or 0
+                print(f"🔄 Сверка вебхуков: активных агентов {self.total}")
+
+                agents = await session.stream_scalars(
+                    select(Agent).where(Agent.is_active == True).execution_options(yield_per=100)
+                )
+                async for agent in agents:
+                    await semaphore.acquire()
+                    task = asyncio.create_task(
+                        self._reconcile_agent(agent.id, agent.encrypted_token, semaphore)
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+            self.status = "done"
+        except Exception as e:
+            self.status = "error"
+            print(f"❌ Ошибка сверки вебхуков: {e}")
+        finally:
+            self.finished_at = time.monotonic()
+
+        print(
+            f"✅ Сверка вебхуков завершена за {self.stats()['elapsed_seconds']} с: "
+            f"проверено {self.checked}, обновлено {self.updated}, ошибок {self.failed}"
+        )
+
+    async def _reconcile_agent(self, agent_id: int, encrypted_token: str, semaphore: asyncio.Semaphore) -> None:
+        expected_url = f"{settings.BASE_URL}/webhook/{agent_id}"
+        # Общая сессия пула: без отдельного коннектора, но и без вытеснения «горячих» ботов из пула
+        bot = Bot(token=decrypt_token(encrypted_token), session=agent_bot_pool.session)
+        try:
+            info = await self._call(bot.get_webhook_info)
+            if info.url != expected_url:
+                # Очередь апдейтов не сбрасываем: сообщения, пришедшие во время деплоя, должны дойти
+                await self._call(bot.set_webhook, url=expected_url)
+                self.updated += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"⚠️ Не удалось сверить вебхук агента {agent_id}: {e}")
+        finally:
+            self.checked += 1
+            semaphore.release()
+            if self.checked % 100 == 0:
+                print(f"🔄 Сверка вебхуков: {self.checked}/{self.total}, обновлено {self.updated}")
+
+    async def _call(self, method, **kwargs) -> Any:
+        for _ in range(MAX_RETRY_AFTER_ATTEMPTS):
+            try:
+                return await method(**kwargs)
+            except TelegramRetryAfter as e:
+                self.rate_limited += 1
+                await asyncio.sleep(e.retry_after)
+        return await method(**kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.monotonic()) - self.started_at, 2)
+        return {
+            "status": self.status,
+            "total": self.total,
+            "checked": self.checked,
+            "updated": self.updated,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "elapsed_seconds": elapsed
+        }
+
+
+webhook_reconciler = WebhookReconciler(concurrency=settings.WEBHOOK_RECONCILE_CONCURRENCY)
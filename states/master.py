@@ -6,4 +6,5 @@ class CreateAgentSG(StatesGroup):
     waiting_docs = State()
     editing_prompt = State()
     adding_extra_docs = State()
+    replacing_doc = State()
     editing_welcome = State()
\ No newline at end of file